@@ -0,0 +1,28 @@
+"""Add message pagination index
+
+Revision ID: 1f193a3b18b9
+Revises: 7e4212347e1d
+Create Date: 2026-10-17 10:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1f193a3b18b9'
+down_revision: Union[str, Sequence[str], None] = '7e4212347e1d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_messages_channel_created', 'messages', ['channel_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_messages_channel_created', table_name='messages')
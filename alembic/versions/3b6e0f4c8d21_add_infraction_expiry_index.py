@@ -0,0 +1,28 @@
+"""Add infraction expiry index
+
+Revision ID: 3b6e0f4c8d21
+Revises: a7f1c3e95b20
+Create Date: 2026-10-17 16:20:07.384115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b6e0f4c8d21'
+down_revision: Union[str, Sequence[str], None] = 'a7f1c3e95b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_infractions_active_expiry', 'infractions', ['expires_at'], unique=False, postgresql_where=sa.text("is_active = 'true'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_infractions_active_expiry', table_name='infractions', postgresql_where=sa.text("is_active = 'true'"))
@@ -0,0 +1,74 @@
+"""Add unread sequences
+
+Revision ID: 5c2d9e81f3a7
+Revises: b84e2c07d9a5
+Create Date: 2026-10-17 13:26:08.771349
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2d9e81f3a7'
+down_revision: Union[str, Sequence[str], None] = 'b84e2c07d9a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('channels', sa.Column('last_message_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('messages', sa.Column('seq', sa.BigInteger(), nullable=True))
+    op.add_column('read_states', sa.Column('last_read_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('read_states', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Number existing messages per channel in creation order
+    op.execute("""
+        UPDATE messages SET seq = numbered.seq
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY channel_id ORDER BY created_at, id) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE messages.id = numbered.id
+    """)
+    op.execute("""
+        UPDATE channels SET last_message_seq = counts.last_seq
+        FROM (SELECT channel_id, max(seq) AS last_seq FROM messages GROUP BY channel_id) AS counts
+        WHERE channels.id = counts.channel_id
+    """)
+    op.execute("""
+        UPDATE read_states SET last_read_seq = coalesce((
+            SELECT max(messages.seq) FROM messages
+            WHERE messages.channel_id = read_states.channel_id
+            AND messages.created_at <= read_states.last_read_at
+        ), 0)
+        WHERE channel_id IS NOT NULL
+    """)
+    # DM counters, creating read states for conversations that were never acked
+    op.execute("""
+        INSERT INTO read_states (id, user_id, dm_other_user_id, last_read_at, unread_count)
+        SELECT gen_random_uuid(), recipient_id, sender_id, to_timestamp(0), 0
+        FROM direct_messages
+        GROUP BY recipient_id, sender_id
+        ON CONFLICT ON CONSTRAINT uq_read_state_user_dm DO NOTHING
+    """)
+    op.execute("""
+        UPDATE read_states SET unread_count = (
+            SELECT count(*) FROM direct_messages
+            WHERE direct_messages.recipient_id = read_states.user_id
+            AND direct_messages.sender_id = read_states.dm_other_user_id
+            AND direct_messages.created_at > read_states.last_read_at
+        )
+        WHERE dm_other_user_id IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('read_states', 'unread_count')
+    op.drop_column('read_states', 'last_read_seq')
+    op.drop_column('messages', 'seq')
+    op.drop_column('channels', 'last_message_seq')
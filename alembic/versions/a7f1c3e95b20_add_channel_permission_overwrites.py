@@ -0,0 +1,41 @@
+"""Add channel permission overwrites
+
+Revision ID: a7f1c3e95b20
+Revises: 5c2d9e81f3a7
+Create Date: 2026-10-17 15:02:44.130952
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7f1c3e95b20'
+down_revision: Union[str, Sequence[str], None] = '5c2d9e81f3a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('channel_permission_overwrites',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('channel_id', sa.UUID(), nullable=False),
+    sa.Column('target_type', sa.Enum('ROLE', 'MEMBER', name='overwrite_target_type'), nullable=False),
+    sa.Column('target_id', sa.UUID(), nullable=False),
+    sa.Column('allow', sa.BigInteger(), nullable=False),
+    sa.Column('deny', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('channel_id', 'target_type', 'target_id', name='uq_channel_overwrite_target')
+    )
+    op.create_index(op.f('ix_channel_permission_overwrites_channel_id'), 'channel_permission_overwrites', ['channel_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_channel_permission_overwrites_channel_id'), table_name='channel_permission_overwrites')
+    op.drop_table('channel_permission_overwrites')
+    sa.Enum(name='overwrite_target_type').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,38 @@
+"""Add DM conversation index
+
+Revision ID: b84e2c07d9a5
+Revises: 1f193a3b18b9
+Create Date: 2026-10-17 11:03:26.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b84e2c07d9a5'
+down_revision: Union[str, Sequence[str], None] = '1f193a3b18b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'idx_direct_messages_conversation',
+        'direct_messages',
+        [
+            sa.text('least(sender_id, recipient_id)'),
+            sa.text('greatest(sender_id, recipient_id)'),
+            'created_at',
+            'id'
+        ],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_direct_messages_conversation', table_name='direct_messages')
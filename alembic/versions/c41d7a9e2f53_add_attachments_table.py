@@ -0,0 +1,41 @@
+"""Add attachments table
+
+Revision ID: c41d7a9e2f53
+Revises: 3b6e0f4c8d21
+Create Date: 2026-10-17 17:05:38.902417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7a9e2f53'
+down_revision: Union[str, Sequence[str], None] = '3b6e0f4c8d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('attachments',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sha256')
+    )
+    op.create_index('idx_attachments_unreferenced', 'attachments', ['last_used_at'], unique=False, postgresql_where=sa.text('ref_count <= 0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_attachments_unreferenced', table_name='attachments', postgresql_where=sa.text('ref_count <= 0'))
+    op.drop_table('attachments')
@@ -0,0 +1,34 @@
+"""Add attachment previews
+
+Revision ID: e2a8b5f17c64
+Revises: c41d7a9e2f53
+Create Date: 2026-10-17 18:11:52.640238
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a8b5f17c64'
+down_revision: Union[str, Sequence[str], None] = 'c41d7a9e2f53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attachments', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('attachments', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('attachments', sa.Column('thumbnail_path', sa.String(), nullable=True))
+    op.add_column('attachments', sa.Column('blurhash', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('attachments', 'blurhash')
+    op.drop_column('attachments', 'thumbnail_path')
+    op.drop_column('attachments', 'height')
+    op.drop_column('attachments', 'width')
@@ -1,41 +1,169 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-import shutil
-import os
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from pydantic import BaseModel
+from typing import Optional
 import uuid
 from app.api import deps
+from app.core import previews, upload_sessions
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.jobs import job_queue
+from app.core.storage import UploadTooLarge, object_url, store_upload
+from app.core.upload_sessions import OffsetMismatch, TooManySessions, UploadBusy
+from app.models.attachment import Attachment
 from app.models.user import User
 
 router = APIRouter()
 
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: int
+
+def attachment_response(attachment, filename: Optional[str]) -> dict:
+    # In production, we would use a CDN or S3 URL
+    # For local dev, we use the local server's URL
+    return {
+        "url": object_url(attachment.path),
+        "filename": filename,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "sha256": attachment.sha256,
+        **previews.preview_fields(attachment)
+    }
+
+async def queue_preview(attachment, current_user: User):
+    """Thumbnail new images in the background; the uploader gets attachment_preview when done."""
+    if previews.wants_preview(attachment):
+        await job_queue.enqueue(
+            "generate_preview", previews.generate_preview, attachment.sha256, str(current_user.id),
+            job_id=f"preview:{attachment.sha256}"
+        )
 
 @router.post("/upload")
 async def upload_attachment(
     file: UploadFile = File(...),
-    current_user: User = Depends(deps.get_current_user)
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Upload a file and return its URL
+    Upload a file and return its URL (the same content always gets the same URL)
     """
-    # Check file size (8MB limit for free users for now)
-    # We can implement more complex logic later
-    
-    file_ext = os.path.splitext(file.filename)[1]
-    file_name = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(UPLOAD_DIR, file_name)
-    
+    # Same limit for every user for now (UPLOAD_MAX_BYTES). BodySizeLimitMiddleware
+    # already refused bodies that are clearly too large; this is the exact check
+    max_bytes = settings.UPLOAD_MAX_BYTES
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        attachment = await store_upload(db, file, max_bytes)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"File is larger than {max_bytes} bytes")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
         
-    # In production, we would use a CDN or S3 URL
-    # For local dev, we use the local server's URL
-    return {
-        "url": f"/uploads/{file_name}",
-        "filename": file.filename,
-        "content_type": file.content_type
-    }
+    await queue_preview(attachment, current_user)
+    return attachment_response(attachment, file.filename)
+
+@router.get("/{sha256}")
+async def get_attachment(
+    sha256: str,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get a stored attachment's URL and preview data (dimensions, thumbnail, blurhash)"""
+    result = await db.execute(select(Attachment).where(Attachment.sha256 == sha256.lower()))
+    attachment = result.scalars().first()
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return attachment_response(attachment, None)
+
+# ============ Resumable uploads ============
+
+async def get_upload_session(session_id: str, current_user: User) -> upload_sessions.UploadSession:
+    try:
+        session_uuid = uuid.UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload ID")
+    session = await upload_sessions.get_session(session_uuid, str(current_user.id))
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+@router.post("/sessions", status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Start a resumable upload; send the bytes with PUT /sessions/{id}?offset=N, then finalize
+    """
+    if session_data.size <= 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    if session_data.size > settings.UPLOAD_SESSION_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File is larger than {settings.UPLOAD_SESSION_MAX_BYTES} bytes")
+
+    try:
+        session = await upload_sessions.create_session(
+            str(current_user.id), session_data.filename, session_data.content_type, session_data.size
+        )
+    except TooManySessions as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {**session.to_dict(), "chunk_size": settings.UPLOAD_CHUNK_SIZE}
+
+@router.get("/sessions/{session_id}")
+async def get_upload_status(
+    session_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Get the offset to resume an upload from"""
+    session = await get_upload_session(session_id, current_user)
+    return session.to_dict()
+
+@router.put("/sessions/{session_id}")
+async def upload_chunk(
+    session_id: str,
+    offset: int,
+    request: Request,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Append the request body to an upload at `offset`"""
+    session = await get_upload_session(session_id, current_user)
+    try:
+        new_offset = await upload_sessions.write_chunk(session, offset, request.stream())
+    except OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": e.offset})
+    except UploadBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Chunk goes past the announced file size")
+    return {"id": session_id, "offset": new_offset, "size": session.size}
+
+@router.post("/sessions/{session_id}/finalize")
+async def finalize_upload(
+    session_id: str,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Complete an upload and store it like a regular attachment (safe to retry if it fails)"""
+    session = await get_upload_session(session_id, current_user)
+    try:
+        attachment = await upload_sessions.finalize(db, session)
+    except OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": "Upload is incomplete", "offset": e.offset})
+    except UploadBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    await queue_preview(attachment, current_user)
+    return attachment_response(attachment, session.filename)
+
+@router.delete("/sessions/{session_id}")
+async def abort_upload(
+    session_id: str,
+    current_user: User = Depends(deps.get_current_user)
+):
+    """Cancel an upload and discard what was received"""
+    session = await get_upload_session(session_id, current_user)
+    await upload_sessions.abort(session)
+    return {"status": "success"}
@@ -41,7 +41,7 @@ async def register(
         user = User(
             email=user_in.email,
             username=user_in.username,
-            hashed_password=security.get_password_hash(user_in.password),
+            hashed_password=await security.get_password_hash_async(user_in.password),
             is_active=True
         )
         db.add(user)
@@ -68,7 +68,7 @@ async def login(
     result = await db.execute(select(User).where(User.email == form_data.username)) # OAuth2 form sends email as username
     user = result.scalars().first()
 
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    if not user or not await security.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect email or password"
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from livekit import api
 import os
@@ -6,10 +7,17 @@ import os
 from app.api import deps
 from app.core import config
 from app.core.database import get_db
+from app.core import storage
+from app.core.pagination import keyset_page
+from app.core.permissions import Permission
+from app.core.channel_permissions import channel_engine
 from app.models.user import User
 from app.models.message import Message
 from app.models.server import Channel
+from app.websockets.manager import manager
+from app.websockets.subscriptions import get_user_subscriptions
 from sqlalchemy import select
+import uuid
 
 router = APIRouter()
 
@@ -50,12 +58,14 @@ async def list_channels(
     db: AsyncSession = Depends(get_db)
 ):
     """
-    List all channels (for MVP we list all, later filter by server)
+    List the channels the user can see, across the servers they belong to
     """
-    from app.models.server import Channel
-    from sqlalchemy import select
-    
-    result = await db.execute(select(Channel))
+    # Same visibility rules as the gateway subscriptions (VIEW_CHANNELS after overwrites)
+    servers = await get_user_subscriptions(db, current_user.id)
+    channel_ids = [uuid.UUID(c) for channel_ids in servers.values() for c in channel_ids]
+    if not channel_ids:
+        return []
+    result = await db.execute(select(Channel).where(Channel.id.in_(channel_ids)))
     channels = result.scalars().all()
     
     # Return simple list for MVP
@@ -64,11 +74,16 @@ async def list_channels(
 @router.get("/{channel_id}/messages")
 async def get_channel_messages(
     channel_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get messages for a specific channel
+    Get a page of messages for a specific channel, oldest first.
+    `before`, `after` and `around` take a message ID; without one the newest messages are returned.
     """
     import uuid as uuid_lib
     try:
@@ -76,14 +91,37 @@ async def get_channel_messages(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid channel ID")
 
+    if not await channel_engine.check(str(channel_uuid), str(current_user.id), Permission.VIEW_CHANNELS, db):
+        raise HTTPException(status_code=403, detail="Missing VIEW_CHANNELS permission")
+
+    cursors = {name: value for name, value in (("before", before), ("after", after), ("around", around)) if value}
+    if len(cursors) > 1:
+        raise HTTPException(status_code=400, detail="Only one of before, after or around can be used")
+
+    positions = {}
+    for name, value in cursors.items():
+        try:
+            cursor_uuid = uuid_lib.UUID(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid {name} message ID")
+        result = await db.execute(
+            select(Message.created_at, Message.id)
+            .where(Message.id == cursor_uuid, Message.channel_id == channel_uuid)
+        )
+        position = result.first()
+        if not position:
+            raise HTTPException(status_code=404, detail="Message not found")
+        positions[name] = tuple(position)
+
     from sqlalchemy.orm import selectinload
-    result = await db.execute(
-        select(Message)
-        .where(Message.channel_id == channel_uuid)
-        .options(selectinload(Message.user))
-        .order_by(Message.created_at.asc())
+    messages = await keyset_page(
+        db,
+        select(Message).where(Message.channel_id == channel_uuid).options(selectinload(Message.user)),
+        Message.created_at,
+        Message.id,
+        limit,
+        **positions
     )
-    messages = result.scalars().all()
     
     return [{
         "id": str(m.id),
@@ -114,8 +152,10 @@ async def edit_channel_message(
     if msg.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You can only edit your own messages")
     
+    old_refs = storage.referenced_hashes(msg.content, msg.attachments)
     msg.content = content
     msg.is_edited = True
+    await storage.update_references(db, old_refs, storage.referenced_hashes(msg.content, msg.attachments))
     await db.commit()
     await db.refresh(msg)
     
@@ -151,6 +191,7 @@ async def delete_channel_message(
     channel_id = str(msg.channel_id)
     msg_id = str(msg.id)
     
+    await storage.release(db, storage.referenced_hashes(msg.content, msg.attachments))
     await db.delete(msg)
     await db.commit()
     
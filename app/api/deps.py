@@ -1,3 +1,4 @@
+import time
 from typing import Generator, Optional
 
 from fastapi import Depends, HTTPException, status
@@ -6,8 +7,10 @@ from jose import jwt, JWTError
 from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
 
 from app.core import security
+from app.core.cache import token_cache, user_cache
 from app.core.config import settings
 from app.core.database import get_db
 from app.models.user import User
@@ -21,19 +24,34 @@ async def get_current_user(
     db: AsyncSession = Depends(get_db),
     token: str = Depends(reusable_oauth2)
 ) -> User:
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
-        )
-        token_data = auth_schemas.TokenPayload(**payload)
-    except (JWTError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
+    user_id = token_cache.get(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+            )
+            token_data = auth_schemas.TokenPayload(**payload)
+            if token_data.sub is None:
+                raise JWTError("Token has no subject")
+        except (JWTError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+        user_id = token_data.sub
+        expires_in = payload["exp"] - time.time() if payload.get("exp") else None
+        token_cache.set(token, user_id, ttl=expires_in)
     
-    result = await db.execute(select(User).where(User.id == token_data.sub))
-    user = result.scalars().first()
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # Fresh detached instance per request; the session treats it like a loaded row
+        user = User(**cached)
+        make_transient_to_detached(user)
+    else:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+        if user:
+            user_cache.set(user_id, {c.key: getattr(user, c.key) for c in User.__table__.columns})
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, or_, and_, case, func, true
 from app.api import deps
 from app.core.database import get_db
 from app.models.user import User
-from app.models.direct_message import DirectMessage
+from app.models.direct_message import DirectMessage, conversation_low, conversation_high
 from app.models.friendship import Friendship, FriendshipStatus
 from app.schemas.friends import DirectMessageCreate, DirectMessageResponse
-from typing import List
+from typing import List, Optional
 import datetime
+import uuid
 import json
 from app.websockets.manager import manager
+from app.core.message_writer import message_writer, new_message_fields
+from app.core import storage
+from app.core.pagination import keyset_page
 from fastapi.encoders import jsonable_encoder
 
 router = APIRouter()
@@ -34,79 +38,114 @@ async def list_dm_conversations(
     db: AsyncSession = Depends(get_db)
 ):
     """List all DM conversations with last message"""
-    # Get all friends
-    result = await db.execute(
-        select(Friendship).where(
-            or_(
-                and_(Friendship.user_id == current_user.id, Friendship.status == FriendshipStatus.ACCEPTED),
-                and_(Friendship.friend_id == current_user.id, Friendship.status == FriendshipStatus.ACCEPTED)
-            )
+    # One query: each accepted friendship, the friend's row and the latest message of the conversation
+    friend_id = case(
+        (Friendship.user_id == current_user.id, Friendship.friend_id),
+        else_=Friendship.user_id
+    )
+    last_msg = (
+        select(DirectMessage.content, DirectMessage.created_at)
+        .where(
+            conversation_low == func.least(current_user.id, friend_id),
+            conversation_high == func.greatest(current_user.id, friend_id)
         )
+        .order_by(DirectMessage.created_at.desc(), DirectMessage.id.desc())
+        .limit(1)
+        .lateral()
     )
-    friendships = result.scalars().all()
-    
-    conversations = []
-    for fs in friendships:
-        friend_id = fs.friend_id if fs.user_id == current_user.id else fs.user_id
-        
-        # Get last message
-        result = await db.execute(
-            select(DirectMessage).where(
-                or_(
-                    and_(DirectMessage.sender_id == current_user.id, DirectMessage.recipient_id == friend_id),
-                    and_(DirectMessage.sender_id == friend_id, DirectMessage.recipient_id == current_user.id)
-                )
-            ).order_by(DirectMessage.created_at.desc()).limit(1)
+    last_message_time = func.coalesce(last_msg.c.created_at, Friendship.created_at)
+    result = await db.execute(
+        select(User.id, User.username, User.avatar_url, last_msg.c.content, last_message_time)
+        .select_from(Friendship)
+        .join(User, User.id == friend_id)
+        .outerjoin(last_msg, true())
+        .where(
+            or_(Friendship.user_id == current_user.id, Friendship.friend_id == current_user.id),
+            Friendship.status == FriendshipStatus.ACCEPTED
         )
-        last_msg = result.scalars().first()
-        
-        # Get friend info
-        result = await db.execute(select(User).where(User.id == friend_id))
-        friend = result.scalars().first()
-        
-        if friend:
-            conversations.append({
-                "friend_id": str(friend.id),
-                "friend_username": friend.username,
-                "friend_avatar": friend.avatar_url,
-                "last_message": last_msg.content if last_msg else None,
-                "last_message_time": last_msg.created_at if last_msg else fs.created_at
-            })
+        .order_by(last_message_time.desc())
+    )
     
-    return sorted(conversations, key=lambda x: x["last_message_time"], reverse=True)
+    return [{
+        "friend_id": str(fid),
+        "friend_username": username,
+        "friend_avatar": avatar_url,
+        "last_message": content,
+        "last_message_time": last_time
+    } for fid, username, avatar_url, content, last_time in result.all()]
+
+def conversation_filter(user_a: uuid.UUID, user_b: uuid.UUID):
+    """Match the messages between two users through the conversation index."""
+    low, high = sorted((user_a, user_b))
+    return and_(conversation_low == low, conversation_high == high)
 
 @router.get("/{user_id}", response_model=List[DirectMessageResponse])
 async def get_dm_history(
     user_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    around: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get message history with a specific user"""
+    """
+    Get a page of message history with a specific user, oldest first.
+    `before`, `after` and `around` take a message ID (`around` is used to jump to a replied message).
+    """
+    try:
+        other_uuid = uuid.UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid user ID format")
+
     # Check if friends
     if not await check_are_friends(str(current_user.id), user_id, db):
         raise HTTPException(status_code=403, detail="You must be friends to view messages")
-    
-    from sqlalchemy.orm import selectinload
-    result = await db.execute(
-        select(DirectMessage).where(
-            or_(
-                and_(DirectMessage.sender_id == current_user.id, DirectMessage.recipient_id == user_id),
-                and_(DirectMessage.sender_id == user_id, DirectMessage.recipient_id == current_user.id)
-            )
+
+    cursors = {name: value for name, value in (("before", before), ("after", after), ("around", around)) if value}
+    if len(cursors) > 1:
+        raise HTTPException(status_code=400, detail="Only one of before, after or around can be used")
+
+    in_conversation = conversation_filter(current_user.id, other_uuid)
+    positions = {}
+    for name, value in cursors.items():
+        try:
+            cursor_uuid = uuid.UUID(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid {name} message ID")
+        result = await db.execute(
+            select(DirectMessage.created_at, DirectMessage.id)
+            .where(DirectMessage.id == cursor_uuid, in_conversation)
         )
-        .options(selectinload(DirectMessage.sender))
-        .order_by(DirectMessage.created_at.asc())
+        position = result.first()
+        if not position:
+            raise HTTPException(status_code=404, detail="Message not found")
+        positions[name] = tuple(position)
+
+    messages = await keyset_page(
+        db,
+        select(DirectMessage).where(in_conversation),
+        DirectMessage.created_at,
+        DirectMessage.id,
+        limit,
+        **positions
     )
-    messages = result.scalars().all()
-    
-    # Map to include avatar
-    response = []
-    for m in messages:
-        m_dict = jsonable_encoder(m)
-        m_dict["sender_avatar"] = m.sender.avatar_url if m.sender else None
-        response.append(m_dict)
-    
-    return response
+
+    # Only two people can appear in a conversation
+    avatars = {current_user.id: current_user.avatar_url}
+    if any(m.sender_id != current_user.id for m in messages):
+        result = await db.execute(select(User.avatar_url).where(User.id == other_uuid))
+        avatars[other_uuid] = result.scalar()
+
+    return [{
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "recipient_id": m.recipient_id,
+        "content": m.content,
+        "reply_to_id": m.reply_to_id,
+        "sender_avatar": avatars.get(m.sender_id),
+        "created_at": m.created_at
+    } for m in messages]
 
 @router.post("/{user_id}", response_model=DirectMessageResponse, status_code=status.HTTP_201_CREATED)
 async def send_dm(
@@ -123,15 +162,21 @@ async def send_dm(
     import uuid
     recipient_uuid = uuid.UUID(user_id) if isinstance(user_id, str) else user_id
 
-    dm = DirectMessage(
-        sender_id=current_user.id,
-        recipient_id=recipient_uuid,
-        content=message.content,
-        reply_to_id=message.reply_to_id
-    )
-    db.add(dm)
-    await db.commit()
-    await db.refresh(dm)
+    row = {
+        **new_message_fields(),
+        "sender_id": current_user.id,
+        "recipient_id": recipient_uuid,
+        "content": message.content,
+        "reply_to_id": message.reply_to_id,
+        "is_edited": False
+    }
+    # Goes out with the next message batch; respond once it is committed
+    try:
+        await (await message_writer.submit(DirectMessage, row))
+    except Exception as e:
+        print(f"Error saving DM: {e}")
+        raise HTTPException(status_code=500, detail="Failed to send message")
+    dm = DirectMessage(**row)
     
     # Broadcast to recipient and sender via WebSocket
     try:
@@ -185,8 +230,10 @@ async def edit_dm(
     if dm.sender_id != current_user.id:
         raise HTTPException(status_code=403, detail="You can only edit your own messages")
     
+    old_refs = storage.referenced_hashes(dm.content, dm.attachments)
     dm.content = message_update.content
     dm.is_edited = True
+    await storage.update_references(db, old_refs, storage.referenced_hashes(dm.content, dm.attachments))
     await db.commit()
     await db.refresh(dm)
     
@@ -226,6 +273,7 @@ async def delete_dm(
     sender_id = str(dm.sender_id)
     msg_id = str(dm.id)
     
+    await storage.release(db, storage.referenced_hashes(dm.content, dm.attachments))
     await db.delete(dm)
     await db.commit()
     
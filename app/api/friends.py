@@ -1,14 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, or_, and_, case
 from app.api import deps
 from app.core.database import get_db
 from app.models.user import User
 from app.models.friendship import Friendship, FriendshipStatus
 from app.schemas.friends import FriendRequestCreate, FriendResponse
+from app.websockets.manager import manager
 
 router = APIRouter()
 
+def page_by_username(query, limit: Optional[int], cursor: Optional[str]):
+    """Order a user listing by username (unique) and apply the optional cursor/limit."""
+    if cursor:
+        query = query.where(User.username > cursor)
+    query = query.order_by(User.username)
+    if limit:
+        query = query.limit(limit)
+    return query
+
 @router.post("/request", status_code=status.HTTP_201_CREATED)
 async def send_friend_request(
     request: FriendRequestCreate,
@@ -53,70 +64,66 @@ async def send_friend_request(
 
 @router.get("/", response_model=list[FriendResponse])
 async def list_friends(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """List all accepted friends"""
-    result = await db.execute(
-        select(Friendship).where(
-            or_(
-                and_(Friendship.user_id == current_user.id, Friendship.status == FriendshipStatus.ACCEPTED),
-                and_(Friendship.friend_id == current_user.id, Friendship.status == FriendshipStatus.ACCEPTED)
-            )
+    """
+    List all accepted friends, ordered by username.
+    With `limit`, pass the last username of a page as `cursor` to get the next one.
+    """
+    friend_id = case(
+        (Friendship.user_id == current_user.id, Friendship.friend_id),
+        else_=Friendship.user_id
+    )
+    query = (
+        select(User, Friendship.created_at)
+        .join(Friendship, User.id == friend_id)
+        .where(
+            or_(Friendship.user_id == current_user.id, Friendship.friend_id == current_user.id),
+            Friendship.status == FriendshipStatus.ACCEPTED
         )
     )
-    friendships = result.scalars().all()
-    
-    friends = []
-    for fs in friendships:
-        friend_id = fs.friend_id if fs.user_id == current_user.id else fs.user_id
-        result = await db.execute(select(User).where(User.id == friend_id))
-        friend = result.scalars().first()
-        if friend:
-            friends.append(FriendResponse(
-                id=friend.id,
-                username=friend.username,
-                email=friend.email,
-                avatar_url=friend.avatar_url,
-                bio=friend.bio,
-                status="ACCEPTED",
-                created_at=fs.created_at
-            ))
-    
-    return friends
+    result = await db.execute(page_by_username(query, limit, cursor))
+    
+    return [FriendResponse(
+        id=friend.id,
+        username=friend.username,
+        email=friend.email,
+        avatar_url=friend.avatar_url,
+        bio=friend.bio,
+        status="ACCEPTED",
+        created_at=created_at
+    ) for friend, created_at in result.all()]
 
 @router.get("/pending", response_model=list[FriendResponse])
 async def list_pending_requests(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """List pending friend requests (received)"""
-    result = await db.execute(
-        select(Friendship).where(
-            and_(
-                Friendship.friend_id == current_user.id,
-                Friendship.status == FriendshipStatus.PENDING
-            )
+    """List pending friend requests (received), paged like list_friends"""
+    query = (
+        select(User, Friendship.created_at)
+        .join(Friendship, User.id == Friendship.user_id)
+        .where(
+            Friendship.friend_id == current_user.id,
+            Friendship.status == FriendshipStatus.PENDING
         )
     )
-    friendships = result.scalars().all()
-    
-    pending = []
-    for fs in friendships:
-        result = await db.execute(select(User).where(User.id == fs.user_id))
-        requester = result.scalars().first()
-        if requester:
-            pending.append(FriendResponse(
-                id=requester.id,
-                username=requester.username,
-                email=requester.email,
-                avatar_url=requester.avatar_url,
-                bio=requester.bio,
-                status="PENDING",
-                created_at=fs.created_at
-            ))
-    
-    return pending
+    result = await db.execute(page_by_username(query, limit, cursor))
+    
+    return [FriendResponse(
+        id=requester.id,
+        username=requester.username,
+        email=requester.email,
+        avatar_url=requester.avatar_url,
+        bio=requester.bio,
+        status="PENDING",
+        created_at=created_at
+    ) for requester, created_at in result.all()]
 
 @router.post("/{user_id}/accept")
 async def accept_friend_request(
@@ -147,6 +154,7 @@ async def accept_friend_request(
     
     friendship.status = FriendshipStatus.ACCEPTED
     await db.commit()
+    await manager.add_friendship(str(user_uuid), str(current_user.id))
     
     return {"message": "Friend request accepted"}
 
@@ -176,7 +184,10 @@ async def remove_friend(
     if not friendship:
         raise HTTPException(status_code=404, detail="Friendship not found")
     
+    was_accepted = friendship.status == FriendshipStatus.ACCEPTED
     await db.delete(friendship)
     await db.commit()
+    if was_accepted:
+        await manager.remove_friendship(str(user_uuid), str(current_user.id))
     
     return {"message": "Friendship removed"}
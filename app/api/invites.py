@@ -5,6 +5,9 @@ from app.api import deps
 from app.core.database import get_db
 from app.models.user import User
 from app.models.server import Server, Invite, ServerMember
+from app.core.sanctions import sanctions
+from app.websockets.manager import manager
+from app.websockets.subscriptions import get_server_channel_ids
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
@@ -137,6 +140,9 @@ async def join_server(
         
     if invite.max_uses > 0 and invite.uses >= invite.max_uses:
         raise HTTPException(status_code=404, detail="Invite limit reached")
+
+    if sanctions.is_banned(str(invite.server_id), str(current_user.id)):
+        raise HTTPException(status_code=403, detail="You are banned from this server")
         
     # Check if already a member
     result = await db.execute(
@@ -159,5 +165,9 @@ async def join_server(
     invite.uses += 1
     
     await db.commit()
+
+    channel_ids = await get_server_channel_ids(db, invite.server_id)
+    await manager.join_server(str(current_user.id), str(invite.server_id), channel_ids)
+    await manager.invalidate_permissions(str(invite.server_id), str(current_user.id))
     
     return {"message": "Joined server", "server_id": str(invite.server_id)}
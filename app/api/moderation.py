@@ -9,10 +9,14 @@ import uuid
 from app.core.database import get_db
 from app.api import deps
 from app.models.user import User
-from app.models.server import Server
+from app.models.server import Server, ServerMember
 from app.models.infraction import Infraction, PunishmentType
 from app.models.audit_log import AuditLogEntry, AuditActionType
 from app.core.permissions import Permission, has_permission
+from app.core.permission_resolver import check_permission
+from app.core.infraction_expiry import expiry_scheduler
+from app.core.jobs import job_queue
+from app.core.message_purge import purge_user_messages
 from app.websockets.manager import manager
 
 router = APIRouter()
@@ -27,6 +31,7 @@ class KickRequest(BaseModel):
 class BanRequest(BaseModel):
     reason: Optional[str] = None
     delete_message_days: Optional[int] = 0  # 0, 1, or 7
+    duration_seconds: Optional[int] = None  # temporary ban; permanent if not set
 
 
 class TimeoutRequest(BaseModel):
@@ -83,14 +88,8 @@ async def check_mod_permission(
     user: User, 
     required_permission: int
 ) -> bool:
-    """Check if user has required permission on server."""
-    # Owner has all permissions
-    if server.owner_id == user.id:
-        return True
-    
-    # TODO: Implement role-based permission check
-    # For now, only owner can moderate
-    return False
+    """Check if user has required permission on server (owner, or through their roles)."""
+    return await check_permission(db, server, user.id, required_permission)
 
 
 async def create_audit_log(
@@ -157,6 +156,17 @@ async def kick_member(
         reason=request.reason
     )
     db.add(infraction)
+
+    # Remove membership
+    result = await db.execute(
+        select(ServerMember).where(
+            ServerMember.server_id == server.id,
+            ServerMember.user_id == target_uuid
+        )
+    )
+    member = result.scalars().first()
+    if member:
+        await db.delete(member)
     
     # Create audit log
     await create_audit_log(
@@ -166,6 +176,9 @@ async def kick_member(
     )
     
     await db.commit()
+
+    await manager.leave_server(str(target_uuid), str(server.id))
+    await manager.invalidate_permissions(str(server.id), str(target_uuid))
     
     # Notify the kicked user via WebSocket
     await manager.send_personal_message({
@@ -201,6 +214,9 @@ async def ban_member(
     
     if target_uuid == server.owner_id:
         raise HTTPException(status_code=403, detail="Cannot ban the server owner")
+
+    if request.delete_message_days not in (None, 0, 1, 7):
+        raise HTTPException(status_code=400, detail="delete_message_days must be 0, 1 or 7")
     
     # Check if already banned
     existing = await db.execute(
@@ -213,6 +229,12 @@ async def ban_member(
     )
     if existing.scalars().first():
         raise HTTPException(status_code=400, detail="User is already banned")
+
+    expires_at = None
+    if request.duration_seconds:
+        if request.duration_seconds < 0:
+            raise HTTPException(status_code=400, detail="Invalid ban duration")
+        expires_at = datetime.utcnow() + timedelta(seconds=request.duration_seconds)
     
     # Create ban record
     infraction = Infraction(
@@ -220,24 +242,51 @@ async def ban_member(
         user_id=target_uuid,
         moderator_id=current_user.id,
         type=PunishmentType.BAN,
-        reason=request.reason
+        reason=request.reason,
+        expires_at=expires_at
     )
     db.add(infraction)
+
+    # Remove membership
+    result = await db.execute(
+        select(ServerMember).where(
+            ServerMember.server_id == server.id,
+            ServerMember.user_id == target_uuid
+        )
+    )
+    member = result.scalars().first()
+    if member:
+        await db.delete(member)
     
     # Create audit log
     await create_audit_log(
         db, server.id, current_user.id,
         AuditActionType.MEMBER_BAN, "user", user_id,
         reason=request.reason,
-        changes={"delete_message_days": request.delete_message_days}
+        changes={
+            "delete_message_days": request.delete_message_days,
+            "expires_at": expires_at.isoformat() if expires_at else None
+        }
     )
     
     await db.commit()
+    await manager.set_sanction(PunishmentType.BAN.value, str(server.id), str(target_uuid), True, expires_at)
+    if expires_at:
+        await expiry_scheduler.schedule(infraction.id, expires_at)
+    if request.delete_message_days:
+        await job_queue.enqueue(
+            "purge_user_messages", purge_user_messages,
+            server.id, target_uuid, request.delete_message_days, current_user.id, request.reason
+        )
+
+    await manager.leave_server(str(target_uuid), str(server.id))
+    await manager.invalidate_permissions(str(server.id), str(target_uuid))
     
     # Notify the banned user
     await manager.send_personal_message({
         "type": "banned",
         "server_id": server_id,
+        "expires_at": expires_at.isoformat() if expires_at else None,
         "reason": request.reason
     }, user_id)
     
@@ -286,6 +335,7 @@ async def unban_member(
     )
     
     await db.commit()
+    await manager.set_sanction(PunishmentType.BAN.value, str(server.id), str(target_uuid), False)
     
     return {"message": "User unbanned successfully"}
 
@@ -361,6 +411,8 @@ async def timeout_member(
     )
     
     await db.commit()
+    await manager.set_sanction(PunishmentType.TIMEOUT.value, str(server.id), str(target_uuid), True, expires_at)
+    await expiry_scheduler.schedule(infraction.id, expires_at)
     
     # Notify the timed out user
     await manager.send_personal_message({
@@ -413,6 +465,7 @@ async def remove_timeout(
     )
     
     await db.commit()
+    await manager.set_sanction(PunishmentType.TIMEOUT.value, str(server.id), str(target_uuid), False)
     
     return {"message": "Timeout removed"}
 
@@ -1,16 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, delete
+from sqlalchemy.orm import selectinload
 from app.api import deps
+from app.core import storage
 from app.core.database import get_db
 from app.models.user import User
-from app.models.server import Server, Channel, ChannelType, ServerMember
+from app.models.server import Server, Channel, ChannelType, ServerMember, ChannelPermissionOverwrite, OverwriteTargetType
+from app.core.permissions import Permission, has_permission, compute_permissions
+from app.core.permission_resolver import check_permission, get_member_permissions
+from app.websockets.manager import manager
 from pydantic import BaseModel
 from typing import Optional
 import uuid
 
 router = APIRouter()
 
+async def check_grantable(db: AsyncSession, server: Server, user_id: uuid.UUID, permissions: int):
+    """Members can only hand out permissions they hold themselves."""
+    own = await get_member_permissions(db, server, user_id)
+    if not has_permission(own, permissions):
+        raise HTTPException(status_code=403, detail="Cannot grant permissions you do not have")
+
 class ServerCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -26,6 +37,10 @@ class RoleCreate(BaseModel):
     permissions: Optional[int] = 0
     is_hoisted: Optional[bool] = False
 
+class OverwriteUpdate(BaseModel):
+    allow: int = 0
+    deny: int = 0
+
 class RoleUpdate(BaseModel):
     name: Optional[str] = None
     color: Optional[str] = None
@@ -64,6 +79,8 @@ async def create_server(
     db.add(default_channel)
     await db.commit()
     await db.refresh(server)
+
+    await manager.join_server(str(current_user.id), str(server.id), [str(default_channel.id)])
     
     return {"id": str(server.id), "name": server.name, "message": "Server created", "owner_id": str(server.owner_id)}
 
@@ -101,13 +118,12 @@ async def create_channel(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid server ID")
     
-    # Check permissions (Owner only for now)
     server = await db.get(Server, server_uuid)
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
         
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only owner can create channels")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_CHANNELS):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_CHANNELS permission")
 
     channel = Channel(
         name=channel_data.name,
@@ -117,6 +133,8 @@ async def create_channel(
     db.add(channel)
     await db.commit()
     await db.refresh(channel)
+
+    await manager.add_channel(str(server_uuid), str(channel.id))
     
     return {"id": str(channel.id), "name": channel.name, "type": channel.type}
 
@@ -141,12 +159,15 @@ async def update_server(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
         
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only owner can update server settings")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_SERVER):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_SERVER permission")
 
     if server_data.name:
         server.name = server_data.name
     if server_data.icon_url:
+        await storage.update_references(
+            db, storage.referenced_hashes(server.icon_url), storage.referenced_hashes(server_data.icon_url)
+        )
         server.icon_url = server_data.icon_url
         
     await db.commit()
@@ -186,6 +207,9 @@ async def leave_server(
 
     await db.delete(member)
     await db.commit()
+
+    await manager.leave_server(str(current_user.id), str(server_uuid))
+    await manager.invalidate_permissions(str(server_uuid), str(current_user.id))
     
     return {"status": "success", "message": "You have left the server"}
 
@@ -208,8 +232,12 @@ async def delete_server(
     if server.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Only owner can delete a server")
 
+    await storage.release(db, storage.referenced_hashes(server.icon_url))
     await db.delete(server)
     await db.commit()
+
+    await manager.remove_server(str(server_uuid))
+    await manager.invalidate_permissions(str(server_uuid))
     
     return {"status": "success", "message": "Server deleted"}
 
@@ -286,9 +314,8 @@ async def kick_member(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
         
-    # Only owner can kick for now (Phase 2 will add permission checks)
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only server owner can kick members")
+    if not await check_permission(db, server, current_user.id, Permission.KICK_MEMBERS):
+        raise HTTPException(status_code=403, detail="Missing KICK_MEMBERS permission")
 
     if target_user_uuid == server.owner_id:
         raise HTTPException(status_code=400, detail="You cannot kick the owner")
@@ -305,6 +332,9 @@ async def kick_member(
 
     await db.delete(member)
     await db.commit()
+
+    await manager.leave_server(str(target_user_uuid), str(server_uuid))
+    await manager.invalidate_permissions(str(server_uuid), str(target_user_uuid))
     
     return {"status": "success", "message": "Member kicked"}
 
@@ -332,15 +362,15 @@ async def update_member(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
         
-    if server.owner_id != current_user.id:
-         raise HTTPException(status_code=403, detail="Only server owner can update members")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_ROLES):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_ROLES permission")
 
-    # Fetch member
+    # Fetch member (with roles loaded so they can be replaced)
     result = await db.execute(
         select(ServerMember).where(
             ServerMember.server_id == server_uuid,
             ServerMember.user_id == target_user_uuid
-        )
+        ).options(selectinload(ServerMember.roles))
     )
     member = result.scalars().first()
     if not member:
@@ -359,9 +389,12 @@ async def update_member(
             )
         )
         roles = res.scalars().all()
+        await check_grantable(db, server, current_user.id, compute_permissions([r.permissions or 0 for r in roles]))
         member.roles = roles
 
     await db.commit()
+    if member_data.role_ids is not None:
+        await manager.update_member_roles(str(server_uuid), str(target_user_uuid), [str(r.id) for r in member.roles])
     return {"status": "success"}
 
 @router.get("/{server_id}/roles")
@@ -411,8 +444,9 @@ async def create_role(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
         
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only owner can create roles")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_ROLES):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_ROLES permission")
+    await check_grantable(db, server, current_user.id, role_data.permissions or 0)
 
     # Get max position
     res = await db.execute(select(func.max(ServerRole.position)).where(ServerRole.server_id == server_uuid))
@@ -429,6 +463,8 @@ async def create_role(
     db.add(role)
     await db.commit()
     await db.refresh(role)
+
+    await manager.update_role(str(server_uuid), str(role.id), role.permissions or 0)
     
     return {"id": str(role.id), "name": role.name}
 
@@ -452,8 +488,8 @@ async def update_role(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
     
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only owner can update roles")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_ROLES):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_ROLES permission")
 
     role = await db.get(ServerRole, role_uuid)
     if not role or role.server_id != server_uuid:
@@ -464,6 +500,7 @@ async def update_role(
     if role_data.color is not None:
         role.color = role_data.color
     if role_data.permissions is not None:
+        await check_grantable(db, server, current_user.id, role_data.permissions)
         role.permissions = role_data.permissions
     if role_data.is_hoisted is not None:
         role.is_hoisted = role_data.is_hoisted
@@ -471,6 +508,7 @@ async def update_role(
         role.position = role_data.position
 
     await db.commit()
+    await manager.update_role(str(server_uuid), str(role_uuid), role.permissions or 0)
     return {"status": "success"}
 
 @router.delete("/{server_id}/roles/{role_id}")
@@ -492,13 +530,141 @@ async def delete_role(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
     
-    if server.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only owner can delete roles")
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_ROLES):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_ROLES permission")
 
     role = await db.get(ServerRole, role_uuid)
     if not role or role.server_id != server_uuid:
         raise HTTPException(status_code=404, detail="Role not found")
 
     await db.delete(role)
+    await db.execute(
+        delete(ChannelPermissionOverwrite).where(
+            ChannelPermissionOverwrite.target_type == OverwriteTargetType.ROLE,
+            ChannelPermissionOverwrite.target_id == role_uuid
+        )
+    )
     await db.commit()
+    await manager.update_role(str(server_uuid), str(role_uuid), None)
+    return {"status": "success"}
+
+async def get_channel_for_overwrites(db: AsyncSession, server_id: str, channel_id: str, current_user: User):
+    """Load a server channel whose overwrites the current user may manage."""
+    try:
+        server_uuid = uuid.UUID(server_id)
+        channel_uuid = uuid.UUID(channel_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+
+    server = await db.get(Server, server_uuid)
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+
+    if not await check_permission(db, server, current_user.id, Permission.MANAGE_ROLES):
+        raise HTTPException(status_code=403, detail="Missing MANAGE_ROLES permission")
+
+    channel = await db.get(Channel, channel_uuid)
+    if not channel or channel.server_id != server_uuid:
+        raise HTTPException(status_code=404, detail="Channel not found")
+    return server, channel
+
+async def publish_overwrites(db: AsyncSession, channel: Channel):
+    """Send a channel's full overwrite list to every worker."""
+    result = await db.execute(
+        select(ChannelPermissionOverwrite).where(ChannelPermissionOverwrite.channel_id == channel.id)
+    )
+    await manager.update_channel_overwrites(str(channel.server_id), str(channel.id), [
+        [o.target_type.value, str(o.target_id), o.allow, o.deny] for o in result.scalars().all()
+    ])
+
+@router.get("/{server_id}/channels/{channel_id}/permissions")
+async def list_channel_overwrites(
+    server_id: str,
+    channel_id: str,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """List the permission overwrites of a channel"""
+    server, channel = await get_channel_for_overwrites(db, server_id, channel_id, current_user)
+    result = await db.execute(
+        select(ChannelPermissionOverwrite).where(ChannelPermissionOverwrite.channel_id == channel.id)
+    )
+    return [
+        {
+            "target_type": o.target_type.value,
+            "target_id": str(o.target_id),
+            "allow": o.allow,
+            "deny": o.deny
+        } for o in result.scalars().all()
+    ]
+
+@router.put("/{server_id}/channels/{channel_id}/permissions/{target_type}/{target_id}")
+async def set_channel_overwrite(
+    server_id: str,
+    channel_id: str,
+    target_type: OverwriteTargetType,
+    target_id: str,
+    overwrite_data: OverwriteUpdate,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Create or replace the overwrite of a role (the server ID for @everyone) or member on a channel"""
+    server, channel = await get_channel_for_overwrites(db, server_id, channel_id, current_user)
+    try:
+        target_uuid = uuid.UUID(target_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid target ID")
+    if overwrite_data.allow & overwrite_data.deny:
+        raise HTTPException(status_code=400, detail="A permission cannot be both allowed and denied")
+    await check_grantable(db, server, current_user.id, overwrite_data.allow | overwrite_data.deny)
+
+    result = await db.execute(
+        select(ChannelPermissionOverwrite).where(
+            ChannelPermissionOverwrite.channel_id == channel.id,
+            ChannelPermissionOverwrite.target_type == target_type,
+            ChannelPermissionOverwrite.target_id == target_uuid
+        )
+    )
+    overwrite = result.scalars().first()
+    if overwrite is None:
+        overwrite = ChannelPermissionOverwrite(channel_id=channel.id, target_type=target_type, target_id=target_uuid)
+        db.add(overwrite)
+    overwrite.allow = overwrite_data.allow
+    overwrite.deny = overwrite_data.deny
+    await db.commit()
+
+    await publish_overwrites(db, channel)
+    return {"status": "success"}
+
+@router.delete("/{server_id}/channels/{channel_id}/permissions/{target_type}/{target_id}")
+async def delete_channel_overwrite(
+    server_id: str,
+    channel_id: str,
+    target_type: OverwriteTargetType,
+    target_id: str,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Remove an overwrite from a channel"""
+    server, channel = await get_channel_for_overwrites(db, server_id, channel_id, current_user)
+    try:
+        target_uuid = uuid.UUID(target_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid target ID")
+
+    result = await db.execute(
+        select(ChannelPermissionOverwrite).where(
+            ChannelPermissionOverwrite.channel_id == channel.id,
+            ChannelPermissionOverwrite.target_type == target_type,
+            ChannelPermissionOverwrite.target_id == target_uuid
+        )
+    )
+    overwrite = result.scalars().first()
+    if not overwrite:
+        raise HTTPException(status_code=404, detail="Overwrite not found")
+
+    await db.delete(overwrite)
+    await db.commit()
+
+    await publish_overwrites(db, channel)
     return {"status": "success"}
@@ -4,10 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.api import deps
-from app.core import security
+from app.core import security, storage
 from app.core.database import get_db
 from app.models.user import User
 from app.schemas import auth as auth_schemas
+from app.websockets.manager import manager
 
 router = APIRouter()
 
@@ -29,6 +30,10 @@ async def update_user_me(
     """
     Update own user.
     """
+    # current_user may be a detached copy from the user cache; the lookups below
+    # load the same row, so work on the session's instance instead
+    current_user = await db.merge(current_user)
+
     if user_in.username is not None:
         # Check if username already exists
         result = await db.execute(select(User).where(User.username == user_in.username))
@@ -55,6 +60,9 @@ async def update_user_me(
         current_user.bio = user_in.bio
     
     if user_in.avatar_url is not None:
+        await storage.update_references(
+            db, storage.referenced_hashes(current_user.avatar_url), storage.referenced_hashes(user_in.avatar_url)
+        )
         current_user.avatar_url = user_in.avatar_url
     
     if user_in.theme is not None:
@@ -73,9 +81,10 @@ async def update_user_me(
         current_user.notif_mentions = user_in.notif_mentions
 
     if user_in.password is not None:
-        current_user.hashed_password = security.get_password_hash(user_in.password)
+        current_user.hashed_password = await security.get_password_hash_async(user_in.password)
 
     db.add(current_user)
     await db.commit()
     await db.refresh(current_user)
+    await manager.invalidate_user(str(current_user.id))
     return current_user
@@ -1,3 +1,7 @@
+import asyncio
+from datetime import datetime
+from functools import partial
+from typing import Awaitable, Callable
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
 from jose import jwt, JWTError
 from pydantic import ValidationError
@@ -5,11 +9,18 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.websockets.manager import manager
+from app.websockets.subscriptions import get_user_subscriptions, get_friend_ids
 from app.core import security
 from app.core.config import settings
 from app.core.database import AsyncSessionLocal
+from app.core.message_writer import message_writer, new_message_fields
+from app.core.ack_buffer import ack_buffer
+from app.core.channel_permissions import channel_engine
+from app.core.sanctions import sanctions
+from app.core.permissions import Permission
 from app.models.user import User
 from app.models.message import Message
+from app.models.direct_message import DirectMessage
 from app.schemas import auth as auth_schemas
 
 router = APIRouter()
@@ -26,143 +37,198 @@ async def get_user_from_token(token: str, db: AsyncSession) -> User:
     result = await db.execute(select(User).where(User.id == token_data.sub))
     return result.scalars().first()
 
+async def acknowledge_persisted(connection, persisted: asyncio.Future, message_id: str, nonce, retract: Callable[[], Awaitable]):
+    """
+    Tell the sender once a broadcast message is durably stored. If the write
+    failed, the sender gets message_failed and everyone who saw it a deletion.
+    """
+    try:
+        await persisted
+    except Exception as e:
+        print(f"Error saving message {message_id}: {e}")
+        connection.send({"type": "message_failed", "id": message_id, "nonce": nonce})
+        await retract()
+        return
+    connection.send({"type": "message_persisted", "id": message_id, "nonce": nonce})
+
+async def retract_dm(message_id: str, sender_id: str, recipient_id: str):
+    delete_payload = {
+        "type": "dm_delete",
+        "id": message_id,
+        "recipient_id": recipient_id,
+        "sender_id": sender_id
+    }
+    await manager.send_personal_message(delete_payload, recipient_id)
+    await manager.send_personal_message(delete_payload, sender_id)
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...)
 ):
     await websocket.accept()
-    # Manual DB session for WebSocket connection
+    # Short-lived session for authentication and the subscription snapshot only;
+    # messages are stored by the message writer, so idle sockets hold no DB connection
     async with AsyncSessionLocal() as db:
         user = await get_user_from_token(token, db)
         if not user or not user.is_active:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
-        await manager.connect(websocket, str(user.id), username=user.username, avatar=user.avatar_url)
-        # Send full presence state to newly connected client
-        await manager.broadcast_full_presence(websocket)
-        try:
-            while True:
-                data = await websocket.receive_json()
-                
-                # Handle ping/heartbeat
-                if data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
-                    continue
-
-                # Handle incoming messages (Channel)
-                if "channel_id" in data and "content" in data:
-                    # Save message to database
-                    import uuid as uuid_lib
-                    try:
-                        channel_uuid = uuid_lib.UUID(data["channel_id"])
-                        new_msg = Message(
-                            content=data["content"],
-                            channel_id=channel_uuid,
-                            user_id=user.id,
-                            reply_to_id=uuid_lib.UUID(data["reply_to_id"]) if data.get("reply_to_id") else None
-                        )
-                        db.add(new_msg)
-                        await db.commit()
-                        await db.refresh(new_msg)
-                        
-                        await manager.broadcast_to_channel(data["channel_id"], {
-                            "type": "message",
-                            "id": str(new_msg.id),
-                            "user": user.username,
-                            "user_id": str(user.id),
-                            "user_avatar": user.avatar_url,
-                            "content": data["content"],
-                            "channel_id": data["channel_id"],
-                            "reply_to_id": data.get("reply_to_id"),
-                            "created_at": new_msg.created_at.isoformat() if new_msg.created_at else None
-                        })
-                    except Exception as e:
-                        print(f"Error saving channel message: {e}")
-
-                # Handle incoming messages (DM)
-                elif data.get("type") == "dm" and "recipient_id" in data and "content" in data:
-                    import uuid as uuid_lib
-                    try:
-                        recipient_uuid = uuid_lib.UUID(data["recipient_id"])
-                        from app.models.direct_message import DirectMessage
-                        
-                        new_dm = DirectMessage(
-                            sender_id=user.id,
-                            recipient_id=recipient_uuid,
-                            content=data["content"],
-                            reply_to_id=uuid_lib.UUID(data["reply_to_id"]) if data.get("reply_to_id") else None
-                        )
-                        db.add(new_dm)
-                        await db.commit()
-                        await db.refresh(new_dm)
-                        
-                        dm_payload = {
-                            "type": "dm",
-                            "id": str(new_dm.id),
-                            "sender_id": str(user.id),
-                            "recipient_id": str(recipient_uuid),
-                            "content": data["content"],
-                            "user": user.username,
-                            "sender_avatar": user.avatar_url,
-                            "reply_to_id": data.get("reply_to_id"),
-                            "created_at": new_dm.created_at.isoformat() if new_dm.created_at else None
-                        }
-                        # Send to recipient and sender instance
-                        await manager.send_personal_message(dm_payload, str(recipient_uuid))
-                        await manager.send_personal_message(dm_payload, str(user.id))
-                    except Exception as e:
-                        print(f"Error saving DM: {e}")
-                
-                # Handle voice state
-                elif data.get("type") == "voice_join":
-                    await manager.handle_voice_join(data["channel_id"], data["user"])
-                elif data.get("type") == "voice_leave":
-                    await manager.handle_voice_leave(data["channel_id"], data["user_id"])
-                
-                # Handle typing indicator
-                elif data.get("type") == "typing_start":
-                    channel_id = data.get("channel_id")
-                    recipient_id = data.get("recipient_id")
-                    typing_payload = {
-                        "type": "typing_start",
+        servers = await get_user_subscriptions(db, user.id)
+        friends = await get_friend_ids(db, user.id)
+
+    connection = await manager.connect(websocket, str(user.id), username=user.username, avatar=user.avatar_url, servers=servers, friends=friends)
+    # Send full presence state to newly connected client
+    manager.broadcast_full_presence(connection)
+    try:
+        while True:
+            data = await websocket.receive_json()
+            
+            # Handle ping/heartbeat
+            if data.get("type") == "ping":
+                connection.send({"type": "pong"})
+                continue
+
+            # Handle incoming messages (Channel)
+            if "channel_id" in data and "content" in data:
+                # Broadcast right away; the message writer stores it in the next batch
+                import uuid as uuid_lib
+                try:
+                    channel_uuid = uuid_lib.UUID(data["channel_id"])
+                    reason = None
+                    server_id = await channel_engine.server_of(str(channel_uuid))
+                    if server_id and sanctions.is_timed_out(server_id, str(user.id)):
+                        reason = "timed_out"
+                    elif not await channel_engine.check(str(channel_uuid), str(user.id), Permission.SEND_MESSAGES):
+                        reason = "missing_permissions"
+                    if reason:
+                        connection.send({"type": "message_failed", "nonce": data.get("nonce"), "reason": reason})
+                        continue
+                    row = {
+                        **new_message_fields(),
+                        "content": data["content"],
+                        "channel_id": channel_uuid,
+                        "user_id": user.id,
+                        "reply_to_id": uuid_lib.UUID(data["reply_to_id"]) if data.get("reply_to_id") else None,
+                        "is_edited": False
+                    }
+                    persisted = await message_writer.submit(Message, row)
+
+                    await manager.broadcast_to_channel(data["channel_id"], {
+                        "type": "message",
+                        "id": str(row["id"]),
+                        "user": user.username,
                         "user_id": str(user.id),
-                        "username": user.username,
-                        "channel_id": channel_id,
-                        "recipient_id": recipient_id
+                        "user_avatar": user.avatar_url,
+                        "content": data["content"],
+                        "channel_id": data["channel_id"],
+                        "reply_to_id": data.get("reply_to_id"),
+                        "created_at": row["created_at"].isoformat()
+                    })
+                    retract = {"type": "message_delete", "id": str(row["id"]), "channel_id": data["channel_id"]}
+                    asyncio.create_task(acknowledge_persisted(
+                        connection, persisted, str(row["id"]), data.get("nonce"),
+                        partial(manager.broadcast_to_channel, data["channel_id"], retract)
+                    ))
+                except Exception as e:
+                    print(f"Error saving channel message: {e}")
+
+            # Handle incoming messages (DM)
+            elif data.get("type") == "dm" and "recipient_id" in data and "content" in data:
+                import uuid as uuid_lib
+                try:
+                    recipient_uuid = uuid_lib.UUID(data["recipient_id"])
+                    row = {
+                        **new_message_fields(),
+                        "sender_id": user.id,
+                        "recipient_id": recipient_uuid,
+                        "content": data["content"],
+                        "reply_to_id": uuid_lib.UUID(data["reply_to_id"]) if data.get("reply_to_id") else None,
+                        "is_edited": False
+                    }
+                    persisted = await message_writer.submit(DirectMessage, row)
+
+                    dm_payload = {
+                        "type": "dm",
+                        "id": str(row["id"]),
+                        "sender_id": str(user.id),
+                        "recipient_id": str(recipient_uuid),
+                        "content": data["content"],
+                        "user": user.username,
+                        "sender_avatar": user.avatar_url,
+                        "reply_to_id": data.get("reply_to_id"),
+                        "created_at": row["created_at"].isoformat()
+                    }
+                    # Send to recipient and sender instance
+                    await manager.send_personal_message(dm_payload, str(recipient_uuid))
+                    await manager.send_personal_message(dm_payload, str(user.id))
+                    asyncio.create_task(acknowledge_persisted(
+                        connection, persisted, str(row["id"]), data.get("nonce"),
+                        partial(retract_dm, str(row["id"]), str(user.id), str(recipient_uuid))
+                    ))
+                except Exception as e:
+                    print(f"Error saving DM: {e}")
+
+            # Handle read acks (same as POST /read-states/ack)
+            elif data.get("type") == "ack":
+                import uuid as uuid_lib
+                try:
+                    read_until = datetime.fromisoformat(data["read_until"]) if data.get("read_until") else None
+                    if data.get("channel_id"):
+                        ack_buffer.ack_channel(user.id, uuid_lib.UUID(data["channel_id"]), read_until)
+                    elif data.get("dm_other_user_id"):
+                        ack_buffer.ack_dm(user.id, uuid_lib.UUID(data["dm_other_user_id"]), read_until)
+                except (ValueError, TypeError):
+                    pass
+
+            # Handle voice state
+            elif data.get("type") == "voice_join":
+                await manager.handle_voice_join(data["channel_id"], data["user"])
+            elif data.get("type") == "voice_leave":
+                await manager.handle_voice_leave(data["channel_id"], data["user_id"])
+            
+            # Handle typing indicator
+            elif data.get("type") == "typing_start":
+                channel_id = data.get("channel_id")
+                recipient_id = data.get("recipient_id")
+                typing_payload = {
+                    "type": "typing_start",
+                    "user_id": str(user.id),
+                    "username": user.username,
+                    "channel_id": channel_id,
+                    "recipient_id": recipient_id
+                }
+                if recipient_id:
+                    # DM typing
+                    await manager.send_personal_message(typing_payload, recipient_id)
+                elif channel_id:
+                    # Channel typing
+                    await manager.broadcast_to_channel(channel_id, typing_payload)
+
+            # Handle status change
+            elif data.get("type") == "set_status":
+                new_status = data.get("status", "online")
+                if new_status in ("online", "idle", "dnd", "invisible"):
+                    await manager.set_status(str(user.id), new_status)
+
+            # Handle call signaling
+            elif data.get("type") in ["call_invite", "call_accept", "call_reject", "call_end"]:
+                target_user_id = data.get("target_user_id")
+                if target_user_id:
+                    call_payload = {
+                        "type": data["type"],
+                        "from_user_id": str(user.id),
+                        "from_username": user.username,
+                        "from_avatar": user.avatar_url,
+                        "room_name": data.get("room_name"),
+                        "call_type": data.get("call_type", "video"),
+                        "target_user_id": target_user_id
                     }
-                    if recipient_id:
-                        # DM typing
-                        await manager.send_personal_message(typing_payload, recipient_id)
-                    elif channel_id:
-                        # Channel typing
-                        await manager.broadcast_to_channel(channel_id, typing_payload)
-
-                # Handle status change
-                elif data.get("type") == "set_status":
-                    new_status = data.get("status", "online")
-                    if new_status in ("online", "idle", "dnd", "invisible"):
-                        manager.user_presence[str(user.id)] = new_status
-                        await manager._broadcast_presence(str(user.id), new_status)
-
-                # Handle call signaling
-                elif data.get("type") in ["call_invite", "call_accept", "call_reject", "call_end"]:
-                    target_user_id = data.get("target_user_id")
-                    if target_user_id:
-                        call_payload = {
-                            "type": data["type"],
-                            "from_user_id": str(user.id),
-                            "from_username": user.username,
-                            "from_avatar": user.avatar_url,
-                            "room_name": data.get("room_name"),
-                            "call_type": data.get("call_type", "video"),
-                            "target_user_id": target_user_id
-                        }
-                        await manager.send_personal_message(call_payload, target_user_id)
-                    
-        except WebSocketDisconnect:
-            manager.disconnect(websocket, str(user.id))
-        except Exception as e:
-            print(f"WebSocket Error: {e}")
-            manager.disconnect(websocket, str(user.id))
+                    await manager.send_personal_message(call_payload, target_user_id)
+                
+    except WebSocketDisconnect:
+        manager.disconnect(connection, str(user.id))
+    except Exception as e:
+        print(f"WebSocket Error: {e}")
+        manager.disconnect(connection, str(user.id))
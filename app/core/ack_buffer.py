@@ -0,0 +1,173 @@
+"""
+Coalesced read acknowledgements.
+
+Clients ack every time a message scrolls into view. Acks are kept in memory
+per (user, channel) / (user, DM peer) and written every ACK_FLUSH_INTERVAL
+seconds as one INSERT ... ON CONFLICT DO UPDATE per kind, so a burst of acks
+for the same conversation costs a single row write.
+
+An ack carries its read position, fixed when it arrives: the created_at of
+the last message the client saw (`read_until`), or the time of receipt. Only
+the highest position per conversation is kept, and a position never moves
+backwards, so messages arriving between the ack and the flush stay unread:
+- channels store the seq of the last message written at or before it;
+- DMs store it as last_read_at and recount the unread messages after it.
+"""
+import asyncio
+import datetime
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.direct_message import DirectMessage, conversation_low, conversation_high
+from app.models.message import Message
+from app.models.read_state import ReadState
+
+CHANNEL = "channel"
+DM = "dm"
+
+
+def read_position(read_until: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """The position an ack reads up to: `read_until` (naive means UTC), but never past now."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if read_until is None:
+        return now
+    if read_until.tzinfo is None:
+        read_until = read_until.replace(tzinfo=datetime.timezone.utc)
+    return min(read_until, now)
+
+
+class AckBuffer:
+    """Buffers the highest read position per conversation and upserts them in batches."""
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval if flush_interval is not None else settings.ACK_FLUSH_INTERVAL
+        # (kind, user_id, target_id) -> read position
+        self._pending: Dict[Tuple[str, uuid.UUID, uuid.UUID], datetime.datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def ack_channel(self, user_id: uuid.UUID, channel_id: uuid.UUID, read_until: Optional[datetime.datetime] = None):
+        """Mark a channel read up to `read_until` (default: now)."""
+        self._add((CHANNEL, user_id, channel_id), read_position(read_until))
+
+    def ack_dm(self, user_id: uuid.UUID, other_user_id: uuid.UUID, read_until: Optional[datetime.datetime] = None):
+        """Mark the conversation with another user read up to `read_until` (default: now)."""
+        self._add((DM, user_id, other_user_id), read_position(read_until))
+
+    def _add(self, key: Tuple[str, uuid.UUID, uuid.UUID], position: datetime.datetime):
+        if key not in self._pending or position > self._pending[key]:
+            self._pending[key] = position
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"DEBUG: Read ack flush failed: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        channel_acks = sorted((u, t, at) for (kind, u, t), at in pending.items() if kind == CHANNEL)
+        dm_acks = sorted((u, t, at) for (kind, u, t), at in pending.items() if kind == DM)
+        for acks, write in ((channel_acks, self._write_channel_acks), (dm_acks, self._write_dm_acks)):
+            if not acks:
+                continue
+            try:
+                await write(acks)
+            except Exception as e:
+                print(f"DEBUG: Batch of {len(acks)} read acks failed, retrying one by one: {e}")
+                # e.g. an ack for a deleted channel; drop only the bad ones
+                for ack in acks:
+                    try:
+                        await write([ack])
+                    except Exception as row_error:
+                        print(f"DEBUG: Dropping read ack {ack}: {row_error}")
+
+    async def _write_channel_acks(self, acks: List[Tuple[uuid.UUID, uuid.UUID, datetime.datetime]]):
+        stmt = pg_insert(ReadState).values([{
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "channel_id": channel_id,
+            # Messages still waiting in the message writer have no seq yet and stay unread
+            "last_read_seq": func.coalesce(
+                select(Message.seq)
+                .where(Message.channel_id == channel_id, Message.created_at <= read_at, Message.seq.is_not(None))
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(1)
+                .scalar_subquery(),
+                0
+            ),
+            "last_read_at": read_at
+        } for user_id, channel_id, read_at in acks])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_read_state_user_channel",
+            set_={
+                # Never move the read marker backwards
+                "last_read_seq": func.greatest(ReadState.last_read_seq, stmt.excluded.last_read_seq),
+                "last_read_at": func.greatest(ReadState.last_read_at, stmt.excluded.last_read_at)
+            }
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt)
+            await db.commit()
+
+    async def _write_dm_acks(self, acks: List[Tuple[uuid.UUID, uuid.UUID, datetime.datetime]]):
+        async with AsyncSessionLocal() as db:
+            # Lock the counters first: the recount below then runs on a snapshot that
+            # includes every DM whose increment committed before it, and the message
+            # writer's next increment waits for this transaction
+            await db.execute(
+                select(ReadState.id)
+                .where(tuple_(ReadState.user_id, ReadState.dm_other_user_id).in_([(u, o) for u, o, _ in acks]))
+                .order_by(ReadState.id)
+                .with_for_update()
+            )
+            stmt = pg_insert(ReadState).values([{
+                "id": uuid.uuid4(),
+                "user_id": user_id,
+                "dm_other_user_id": other_user_id,
+                "unread_count": select(func.count()).select_from(DirectMessage).where(
+                    # Matches the conversation index (uuids sort the same in Python and Postgres)
+                    conversation_low == min(user_id, other_user_id),
+                    conversation_high == max(user_id, other_user_id),
+                    DirectMessage.sender_id == other_user_id,
+                    DirectMessage.recipient_id == user_id,
+                    DirectMessage.created_at > read_at
+                ).scalar_subquery(),
+                "last_read_at": read_at
+            } for user_id, other_user_id, read_at in acks])
+            newer = stmt.excluded.last_read_at > ReadState.last_read_at
+            stmt = stmt.on_conflict_do_update(
+                constraint="uq_read_state_user_dm",
+                set_={
+                    # An older position than the stored one changes nothing
+                    "unread_count": case((newer, stmt.excluded.unread_count), else_=ReadState.unread_count),
+                    "last_read_at": func.greatest(ReadState.last_read_at, stmt.excluded.last_read_at)
+                }
+            )
+            await db.execute(stmt)
+            await db.commit()
+
+
+ack_buffer = AckBuffer()
@@ -0,0 +1,60 @@
+"""
+Process-local caches for hot lookups.
+
+Entries expire after a TTL and the least recently used ones are evicted once
+the cache is full. Anything that changes a cached row must invalidate it
+(through the gateway backplane, so every worker drops its copy).
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from app.core.config import settings
+
+
+class TTLCache:
+    """LRU cache whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]):
+        """Drop every entry whose key matches `predicate`."""
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Decoded access tokens (token -> user ID); entries never outlive the token
+token_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+# Column values of authenticated users (user ID -> dict)
+user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
@@ -0,0 +1,238 @@
+"""
+Effective channel permissions and visibility.
+
+For every server that is in use on this worker, ServerPermissions holds the
+members' roles, the role bitmasks and the channel overwrites. A member's
+permissions in every channel of the server are computed the first time that
+member is looked up (server-level bits come from permission_resolver, so both
+paths share one definition) and kept, so REST checks are then a dict lookup
+and the gateway subscribes sockets only to visible channels. Members nobody
+asks about cost nothing beyond their role list.
+
+Changes are applied incrementally (one channel for the members computed so
+far, or the cached results of one member or of the holders of one role are
+dropped) from backplane events, so every worker stays in sync without
+reloading the server.
+"""
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.permission_resolver import member_permissions
+from app.core.permissions import Permission, apply_overwrites, has_permission
+from app.models.server import (
+    Server, Channel, ServerMember, ServerRole, ChannelPermissionOverwrite, OverwriteTargetType,
+    member_role_association
+)
+
+# (target_type, target_id) -> (allow, deny); all IDs are strings
+Overwrites = Dict[Tuple[str, str], Tuple[int, int]]
+
+ROLE = OverwriteTargetType.ROLE.value
+MEMBER = OverwriteTargetType.MEMBER.value
+
+
+class ServerPermissions:
+    """Channel permissions of one server, computed per member on first use."""
+
+    def __init__(
+        self,
+        server_id: str,
+        owner_id: str,
+        roles: Dict[str, int],
+        members: Dict[str, Set[str]],
+        channels: Dict[str, Overwrites]
+    ):
+        self.server_id = server_id
+        self.owner_id = owner_id
+        self.roles = roles  # role_id -> permissions
+        self.members = members  # user_id -> role_ids
+        self.members.setdefault(owner_id, set())
+        self.overwrites = channels  # channel_id -> overwrites
+        self._effective: Dict[str, Dict[str, int]] = {}  # user_id -> channel_id -> permissions, once computed
+
+    def base_permissions(self, user_id: str) -> int:
+        role_ids = self.members.get(user_id)
+        return member_permissions(
+            user_id == self.owner_id,
+            None if role_ids is None else [self.roles.get(r, 0) for r in role_ids]
+        )
+
+    def _compute(self, channel_id: str, user_id: str) -> int:
+        base = self.base_permissions(user_id)
+        if not base:
+            return 0
+        overwrites = self.overwrites.get(channel_id, {})
+        return apply_overwrites(
+            base,
+            overwrites.get((ROLE, self.server_id)),
+            [overwrites[(ROLE, r)] for r in self.members.get(user_id, ()) if (ROLE, r) in overwrites],
+            overwrites.get((MEMBER, user_id))
+        )
+
+    def _member(self, user_id: str) -> Dict[str, int]:
+        """channel_id -> permissions of one member (empty for non-members)."""
+        effective = self._effective.get(user_id)
+        if effective is None:
+            if user_id not in self.members:
+                return {}
+            effective = {channel_id: self._compute(channel_id, user_id) for channel_id in self.overwrites}
+            self._effective[user_id] = effective
+        return effective
+
+    # ---- Lookups ----
+
+    def channel_permissions(self, channel_id: str, user_id: str) -> int:
+        return self._member(user_id).get(channel_id, 0)
+
+    def can_view(self, channel_id: str, user_id: str) -> bool:
+        return has_permission(self.channel_permissions(channel_id, user_id), Permission.VIEW_CHANNELS)
+
+    def visible_channels(self, user_id: str) -> List[str]:
+        return [
+            channel_id for channel_id, permissions in self._member(user_id).items()
+            if has_permission(permissions, Permission.VIEW_CHANNELS)
+        ]
+
+    # ---- Incremental updates ----
+
+    def set_overwrites(self, channel_id: str, overwrites: Overwrites):
+        self.overwrites[channel_id] = overwrites
+        for user_id, effective in self._effective.items():
+            effective[channel_id] = self._compute(channel_id, user_id)
+
+    def remove_channel(self, channel_id: str):
+        self.overwrites.pop(channel_id, None)
+        for effective in self._effective.values():
+            effective.pop(channel_id, None)
+
+    def set_member(self, user_id: str, role_ids: Optional[Iterable[str]]):
+        """Update a member's roles; None removes the member."""
+        self._effective.pop(user_id, None)
+        if role_ids is None and user_id != self.owner_id:
+            self.members.pop(user_id, None)
+            return
+        self.members[user_id] = set(role_ids or ())
+
+    def set_role(self, role_id: str, permissions: Optional[int]) -> List[str]:
+        """Update a role's bitmask; None deletes it. Returns the affected members."""
+        if permissions is None:
+            self.roles.pop(role_id, None)
+            for channel_id, overwrites in self.overwrites.items():
+                overwrites.pop((ROLE, role_id), None)
+        else:
+            self.roles[role_id] = permissions
+        affected = [u for u, role_ids in self.members.items() if role_id in role_ids]
+        if permissions is None:
+            for user_id in affected:
+                self.members[user_id].discard(role_id)
+        for user_id in affected:
+            self._effective.pop(user_id, None)
+        return affected
+
+
+class ChannelPermissionEngine:
+    """Loads ServerPermissions on first use and keeps them for the lifetime of the cache entry."""
+
+    def __init__(self):
+        self.servers = TTLCache(settings.CHANNEL_PERMISSION_CACHE_SIZE, settings.CHANNEL_PERMISSION_CACHE_TTL)
+        self.channel_servers: Dict[str, str] = {}  # channel_id -> server_id
+
+    def loaded(self, server_id: str) -> Optional[ServerPermissions]:
+        return self.servers.get(server_id)
+
+    async def get(self, server_id: str, db: AsyncSession = None) -> Optional[ServerPermissions]:
+        state = self.servers.get(server_id)
+        if state is None:
+            if db is None:
+                async with AsyncSessionLocal() as session:
+                    state = await self._load(session, server_id)
+            else:
+                state = await self._load(db, server_id)
+            if state is not None:
+                self.servers.set(server_id, state)
+        return state
+
+    async def _load(self, db: AsyncSession, server_id: str) -> Optional[ServerPermissions]:
+        server_uuid = uuid.UUID(server_id)
+        owner_id = (await db.execute(select(Server.owner_id).where(Server.id == server_uuid))).scalar()
+        if owner_id is None:
+            return None
+
+        roles = {
+            str(role_id): permissions or 0
+            for role_id, permissions in await db.execute(
+                select(ServerRole.id, ServerRole.permissions).where(ServerRole.server_id == server_uuid)
+            )
+        }
+        members: Dict[str, Set[str]] = {}
+        for user_id, role_id in await db.execute(
+            select(ServerMember.user_id, member_role_association.c.role_id)
+            .outerjoin(member_role_association, member_role_association.c.member_id == ServerMember.id)
+            .where(ServerMember.server_id == server_uuid)
+        ):
+            role_ids = members.setdefault(str(user_id), set())
+            if role_id is not None:
+                role_ids.add(str(role_id))
+
+        channels: Dict[str, Overwrites] = {}
+        for channel_id, target_type, target_id, allow, deny in await db.execute(
+            select(
+                Channel.id,
+                ChannelPermissionOverwrite.target_type,
+                ChannelPermissionOverwrite.target_id,
+                ChannelPermissionOverwrite.allow,
+                ChannelPermissionOverwrite.deny
+            )
+            .outerjoin(ChannelPermissionOverwrite, ChannelPermissionOverwrite.channel_id == Channel.id)
+            .where(Channel.server_id == server_uuid)
+        ):
+            overwrites = channels.setdefault(str(channel_id), {})
+            self.channel_servers[str(channel_id)] = server_id
+            if target_type is not None:
+                overwrites[(target_type.value, str(target_id))] = (allow or 0, deny or 0)
+
+        return ServerPermissions(server_id, str(owner_id), roles, members, channels)
+
+    async def server_of(self, channel_id: str, db: AsyncSession = None) -> Optional[str]:
+        server_id = self.channel_servers.get(channel_id)
+        if server_id is None:
+            query = select(Channel.server_id).where(Channel.id == uuid.UUID(channel_id))
+            if db is None:
+                async with AsyncSessionLocal() as session:
+                    server_uuid = (await session.execute(query)).scalar()
+            else:
+                server_uuid = (await db.execute(query)).scalar()
+            if server_uuid is None:
+                return None
+            server_id = str(server_uuid)
+            self.channel_servers[channel_id] = server_id
+        return server_id
+
+    async def channel_permissions(self, channel_id: str, user_id: str, db: AsyncSession = None) -> int:
+        """Effective permissions of a user in a channel (0 if the channel doesn't exist)."""
+        server_id = await self.server_of(channel_id, db)
+        if server_id is None:
+            return 0
+        state = await self.get(server_id, db)
+        return state.channel_permissions(channel_id, user_id) if state else 0
+
+    async def check(self, channel_id: str, user_id: str, required_permission: int, db: AsyncSession = None) -> bool:
+        return has_permission(await self.channel_permissions(channel_id, user_id, db), required_permission)
+
+    async def visible_channels(self, server_id: str, user_id: str, db: AsyncSession = None) -> List[str]:
+        state = await self.get(server_id, db)
+        return state.visible_channels(user_id) if state else []
+
+    def forget(self, server_id: str):
+        self.servers.delete(server_id)
+        for channel_id in [c for c, s in self.channel_servers.items() if s == server_id]:
+            del self.channel_servers[channel_id]
+
+
+channel_engine = ChannelPermissionEngine()
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -20,6 +21,45 @@ class Settings(BaseSettings):
     LIVEKIT_API_SECRET: str
     LIVEKIT_URL: str
 
+    # WebSocket gateway
+    GATEWAY_BACKPLANE: str = "local"  # "local" (single worker) or "redis"
+    GATEWAY_REDIS_CHANNEL: str = "deepcall:gateway"
+    WS_SEND_QUEUE_SIZE: int = 256  # outbound events buffered per socket
+    WS_DROPPABLE_EVENTS: List[str] = ["typing_start", "presence_update"]  # dropped oldest-first on overflow
+    PRESENCE_COALESCE_SECONDS: float = 5.0  # min interval between presence updates of one user
+    MESSAGE_BATCH_SIZE: int = 200  # max messages per INSERT batch
+    MESSAGE_FLUSH_INTERVAL: float = 0.02  # max seconds a message waits before being written
+    MESSAGE_QUEUE_SIZE: int = 10000  # messages waiting to be written before senders are slowed down
+    USER_CACHE_SIZE: int = 10000  # authenticated users kept per worker
+    USER_CACHE_TTL: float = 60.0  # seconds before a cached user is reloaded (0 disables the cache)
+    PASSWORD_HASH_WORKERS: int = 4  # threads running bcrypt
+    PASSWORD_HASH_MAX_PENDING: int = 64  # hashes submitted to the pool at once per worker
+    PASSWORD_HASH_STATS_INTERVAL: float = 60.0  # seconds between logs of the pool's load
+    ACK_FLUSH_INTERVAL: float = 1.0  # seconds read acks are coalesced before being written
+    PERMISSION_CACHE_SIZE: int = 50000  # (server, member) permission bitmasks kept per worker
+    PERMISSION_CACHE_TTL: float = 300.0  # safety net; role/member changes invalidate explicitly
+    CHANNEL_PERMISSION_CACHE_SIZE: int = 1000  # servers with precomputed channel permissions per worker
+    CHANNEL_PERMISSION_CACHE_TTL: float = 3600.0  # kept up to date by events; reloaded after this long
+
+    # Background jobs
+    JOB_BACKEND: str = "local"  # "local" (tasks of the API process) or "arq" (arq worker on REDIS_URL)
+    PURGE_BATCH_SIZE: int = 500  # messages deleted per transaction by a ban purge
+    PURGE_BATCH_PAUSE: float = 0.05  # seconds between purge chunks
+
+    # Attachments
+    UPLOAD_DIR: str = "uploads"  # served at /uploads
+    UPLOAD_TMP_DIR: str = "uploads-incoming"  # uploads in progress; same filesystem as UPLOAD_DIR, not served
+    UPLOAD_MAX_BYTES: int = 8 * 1024 * 1024  # per file, for every user
+    UPLOAD_CHUNK_SIZE: int = 256 * 1024  # bytes read/written per step while storing an upload
+    UPLOAD_ORPHAN_TTL: float = 24 * 3600.0  # seconds a stored file is kept while nothing links to it
+    UPLOAD_GC_INTERVAL: float = 3600.0  # seconds between collections of unreferenced files (the arq worker runs it hourly)
+    UPLOAD_SESSION_MAX_BYTES: int = 512 * 1024 * 1024  # per file, for resumable uploads
+    UPLOAD_SESSION_TTL: float = 24 * 3600.0  # seconds an idle resumable upload is kept
+    UPLOAD_SESSION_SWEEP_INTERVAL: float = 600.0  # seconds between sweeps of idle uploads (the arq worker runs it every 10 minutes)
+    UPLOAD_SESSION_MAX_PER_USER: int = 5  # resumable uploads a user can have in progress
+    PREVIEW_MAX_SIZE: int = 320  # longest side of image thumbnails, in pixels
+    PREVIEW_WORKERS: int = 2  # processes decoding images for previews
+
     @property
     def DATABASE_URL(self) -> str:
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
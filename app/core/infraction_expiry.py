@@ -0,0 +1,153 @@
+"""
+Expiry of timeouts and temporary bans.
+
+Every infraction with an `expires_at` gets a job scheduled for that moment.
+With JOB_BACKEND=arq the job is deferred on the arq queue in Redis and run
+by `arq app.worker.WorkerSettings`; otherwise this process keeps its own
+timers (single worker, scripts, tests). Either way the job deactivates
+everything that is due in one UPDATE, writes the audit entries and tells the
+affected users over the gateway, so nobody has to poll for expiry.
+"""
+import asyncio
+import heapq
+import uuid
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+
+from app.core.database import AsyncSessionLocal
+from app.core.jobs import job_queue
+from app.models.audit_log import AuditLogEntry, AuditActionType
+from app.models.infraction import Infraction, PunishmentType
+
+EXPIRY_AUDIT_ACTIONS = {
+    PunishmentType.TIMEOUT: AuditActionType.MEMBER_TIMEOUT_REMOVE,
+    PunishmentType.BAN: AuditActionType.MEMBER_UNBAN,
+}
+
+EXPIRY_EVENTS = {
+    PunishmentType.TIMEOUT: "timeout_expired",
+    PunishmentType.BAN: "ban_expired",
+}
+
+
+async def expire_infractions(infraction_ids: Optional[Iterable[uuid.UUID]] = None) -> List[Tuple]:
+    """
+    Deactivate the infractions that are due (only `infraction_ids`, if given),
+    log and announce each one. Returns (id, server_id, user_id, type, expires_at) rows.
+    """
+    stmt = (
+        update(Infraction)
+        .where(Infraction.is_active == "true", Infraction.expires_at <= datetime.utcnow())
+        .values(is_active="false")
+        .returning(Infraction.id, Infraction.server_id, Infraction.user_id, Infraction.type, Infraction.expires_at)
+    )
+    if infraction_ids is not None:
+        stmt = stmt.where(Infraction.id.in_(list(infraction_ids)))
+
+    async with AsyncSessionLocal() as db:
+        expired = (await db.execute(stmt)).all()
+        if expired:
+            await db.execute(insert(AuditLogEntry).values([{
+                "id": uuid.uuid4(),
+                "server_id": server_id,
+                "actor_id": None,
+                "action_type": EXPIRY_AUDIT_ACTIONS.get(kind, AuditActionType.MEMBER_TIMEOUT_REMOVE),
+                "target_type": "user",
+                "target_id": str(user_id),
+                "reason": "Expired",
+                "changes": {"infraction_id": str(infraction_id)},
+                "created_at": datetime.utcnow()
+            } for infraction_id, server_id, user_id, kind, _ in expired]))
+        await db.commit()
+
+    from app.websockets.manager import manager
+    for infraction_id, server_id, user_id, kind, expires_at in expired:
+        await manager.set_sanction(kind.value, str(server_id), str(user_id), False, expires_at)
+        await manager.send_personal_message({
+            "type": EXPIRY_EVENTS.get(kind, "infraction_expired"),
+            "server_id": str(server_id),
+            "infraction_id": str(infraction_id)
+        }, str(user_id))
+    if expired:
+        print(f"DEBUG: Expired {len(expired)} infractions")
+    return expired
+
+
+async def get_pending_expiries() -> List[Tuple[datetime, uuid.UUID]]:
+    """Active infractions that will expire, soonest first."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Infraction.expires_at, Infraction.id)
+            .where(Infraction.is_active == "true", Infraction.expires_at.is_not(None))
+            .order_by(Infraction.expires_at)
+        )
+        return [tuple(row) for row in result.all()]
+
+
+class ExpiryScheduler:
+    """Schedules expire_infractions() at each infraction's expires_at."""
+
+    def __init__(self):
+        self._timers: List[Tuple[datetime, uuid.UUID]] = []  # heap of (expires_at, infraction_id)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start after job_queue, which decides where the jobs run."""
+        if job_queue.uses_arq:
+            return
+        # In-process: pick up whatever was scheduled before a restart
+        try:
+            for expires_at, infraction_id in await get_pending_expiries():
+                heapq.heappush(self._timers, (expires_at, infraction_id))
+        except Exception as e:
+            print(f"DEBUG: Could not load pending infraction expiries: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def schedule(self, infraction_id: uuid.UUID, expires_at: datetime):
+        """Expire `infraction_id` at `expires_at` (naive UTC, like Infraction.expires_at)."""
+        if job_queue.uses_arq:
+            await job_queue.enqueue(
+                "expire_infraction", expire_infractions, [infraction_id],
+                job_id=f"infraction-expiry:{infraction_id}",
+                defer_by=max(0.0, (expires_at - datetime.utcnow()).total_seconds())
+            )
+            return
+        heapq.heappush(self._timers, (expires_at, infraction_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._timers:
+                await self._wakeup.wait()
+                continue
+            delay = (self._timers[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = []
+            now = datetime.utcnow()
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[1])
+            try:
+                await expire_infractions(due)
+            except Exception as e:
+                print(f"DEBUG: Infraction expiry failed: {e}")
+
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,80 @@
+"""
+Background jobs.
+
+With JOB_BACKEND=arq, jobs are enqueued on the arq queue in Redis and run by
+`arq app.worker.WorkerSettings` (which registers a function of the same name
+for each of them). Otherwise they run as tasks of this process, which is
+enough for a single worker, scripts and tests. Periodic maintenance works the
+same way: cron jobs of the arq worker, or loops started with every().
+"""
+import asyncio
+from typing import Awaitable, Callable, Optional, Set
+
+from app.core.config import settings
+
+
+class JobQueue:
+    def __init__(self):
+        self._arq = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def uses_arq(self) -> bool:
+        return self._arq is not None
+
+    async def start(self):
+        if settings.JOB_BACKEND == "arq":
+            from arq import create_pool
+            from arq.connections import RedisSettings
+            self._arq = await create_pool(RedisSettings.from_dsn(settings.REDIS_URL))
+
+    async def stop(self):
+        if self._arq is not None:
+            await self._arq.aclose()
+            self._arq = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def enqueue(
+        self,
+        name: str,
+        function: Callable[..., Awaitable],
+        *args,
+        job_id: Optional[str] = None,
+        defer_by: float = 0.0
+    ):
+        """Run `function(*args)` in the background (arq job `name` when using arq)."""
+        if self._arq is not None:
+            await self._arq.enqueue_job(name, *args, _job_id=job_id, _defer_by=defer_by or None)
+            return
+        task = asyncio.create_task(self._run(name, function, args, defer_by))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def every(self, name: str, function: Callable[[], Awaitable], interval: float, in_process: bool = False):
+        """
+        Run `function()` every `interval` seconds in this process; with arq the
+        worker's cron jobs do it, unless the job is about this process (`in_process`).
+        """
+        if self._arq is not None and not in_process:
+            return
+        task = asyncio.create_task(self._repeat(name, function, interval))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _repeat(self, name: str, function: Callable[[], Awaitable], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self._run(name, function, (), 0.0)
+
+    async def _run(self, name: str, function: Callable[..., Awaitable], args: tuple, defer_by: float):
+        if defer_by > 0:
+            await asyncio.sleep(defer_by)
+        try:
+            await function(*args)
+        except Exception as e:
+            print(f"DEBUG: Background job {name} failed: {e}")
+
+
+job_queue = JobQueue()
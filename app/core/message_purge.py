@@ -0,0 +1,82 @@
+"""
+Bulk deletion of a member's recent messages (ban with delete_message_days).
+
+Runs as a background job: messages are deleted channel by channel in chunks
+of at most PURGE_BATCH_SIZE rows, each in its own short transaction, so a
+raid cleanup never holds long locks on `messages`. Every chunk is announced
+to the channel as one message_bulk_delete event.
+"""
+import asyncio
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+
+from app.core import storage
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.audit_log import AuditLogEntry, AuditActionType
+from app.models.message import Message
+from app.models.server import Channel
+
+
+async def purge_user_messages(
+    server_id: uuid.UUID,
+    user_id: uuid.UUID,
+    days: int,
+    actor_id: Optional[uuid.UUID] = None,
+    reason: Optional[str] = None
+) -> int:
+    """Delete what `user_id` wrote in the server's channels over the last `days` days."""
+    from app.websockets.manager import manager
+
+    async with AsyncSessionLocal() as db:
+        channel_ids = (await db.execute(select(Channel.id).where(Channel.server_id == server_id))).scalars().all()
+
+    since = func.now() - timedelta(days=days)
+    deleted = 0
+    for channel_id in channel_ids:
+        while True:
+            chunk = (
+                select(Message.id)
+                .where(Message.channel_id == channel_id, Message.user_id == user_id, Message.created_at >= since)
+                .limit(settings.PURGE_BATCH_SIZE)
+            )
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    delete(Message).where(Message.id.in_(chunk))
+                    .returning(Message.id, Message.content, Message.attachments)
+                )
+                rows = result.all()
+                ids = [str(row.id) for row in rows]
+                await storage.release(db, [
+                    sha256 for row in rows for sha256 in storage.referenced_hashes(row.content, row.attachments)
+                ])
+                await db.commit()
+            if not ids:
+                break
+            deleted += len(ids)
+            await manager.broadcast_to_channel(str(channel_id), {
+                "type": "message_bulk_delete",
+                "channel_id": str(channel_id),
+                "ids": ids
+            })
+            if len(ids) < settings.PURGE_BATCH_SIZE:
+                break
+            # Let other writers at the table between chunks
+            await asyncio.sleep(settings.PURGE_BATCH_PAUSE)
+
+    async with AsyncSessionLocal() as db:
+        db.add(AuditLogEntry(
+            server_id=server_id,
+            actor_id=actor_id,
+            action_type=AuditActionType.MESSAGE_BULK_DELETE,
+            target_type="user",
+            target_id=str(user_id),
+            reason=reason,
+            changes={"delete_message_days": days, "deleted": deleted}
+        ))
+        await db.commit()
+    print(f"DEBUG: Purged {deleted} messages of {user_id} in server {server_id}")
+    return deleted
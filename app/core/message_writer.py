@@ -0,0 +1,176 @@
+"""
+Write-behind persistence for chat messages.
+
+Senders build a message with an application-assigned id and timestamp,
+broadcast it right away and hand the row to the writer. The writer gathers
+rows for at most MESSAGE_FLUSH_INTERVAL seconds (or MESSAGE_BATCH_SIZE rows)
+and stores them with one multi-row INSERT per table in a single transaction.
+The same transaction numbers channel messages (Channel.last_message_seq)
+and bumps the recipients' DM unread counters. It also takes a reference on
+every stored attachment a message links to (see app.core.storage).
+Each submit() returns a future that resolves once the row is committed, so
+callers can acknowledge durability (or retract the message on failure).
+"""
+import asyncio
+import datetime
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core import storage
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.message import Message
+from app.models.direct_message import DirectMessage
+from app.models.read_state import ReadState
+from app.models.server import Channel
+
+# Insert order inside a batch (both tables only reference themselves and users/channels)
+TABLES = (Message, DirectMessage)
+
+
+def new_message_fields() -> dict:
+    """ID and timestamps assigned by the application instead of the database."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {"id": uuid.uuid4(), "created_at": now}
+
+
+class MessageWriter:
+    """Batches message INSERTs behind a bounded queue drained by one task."""
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, max_pending: int = None):
+        self.batch_size = batch_size or settings.MESSAGE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MESSAGE_FLUSH_INTERVAL
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_pending = max_pending or settings.MESSAGE_QUEUE_SIZE
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self._max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is still queued, then stop the writer."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, model, row: dict) -> asyncio.Future:
+        """
+        Queue a row of `model` (Message or DirectMessage) for insertion. Waits only
+        when the queue is full; the returned future resolves on commit.
+        """
+        if self._task is None:
+            raise RuntimeError("MessageWriter is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((model, row, future))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple]):
+        if not batch:
+            return
+        try:
+            await self._insert(batch)
+        except Exception as e:
+            print(f"DEBUG: Batch insert of {len(batch)} messages failed, retrying one by one: {e}")
+            # Isolate the bad rows so one invalid message doesn't sink the batch
+            for item in batch:
+                try:
+                    await self._insert([item])
+                except Exception as row_error:
+                    if not item[2].done():
+                        item[2].set_exception(row_error)
+                    continue
+                if not item[2].done():
+                    item[2].set_result(item[1]["id"])
+            return
+        for _, row, future in batch:
+            if not future.done():
+                future.set_result(row["id"])
+
+    async def _insert(self, batch: List[Tuple]):
+        async with AsyncSessionLocal() as db:
+            for model in TABLES:
+                rows = [row for m, row, _ in batch if m is model]
+                if not rows:
+                    continue
+                if model is Message:
+                    await self._assign_sequences(db, rows)
+                await db.execute(insert(model).values(rows))
+                if model is DirectMessage:
+                    await self._count_unread_dms(db, rows)
+            await storage.acquire(db, [
+                sha256 for _, row, _ in batch
+                for sha256 in storage.referenced_hashes(row.get("content"), row.get("attachments"))
+            ])
+            await db.commit()
+
+    async def _assign_sequences(self, db, rows: List[dict]):
+        """Reserve a block of sequence numbers per channel and number the rows in order."""
+        per_channel: Dict[uuid.UUID, List[dict]] = {}
+        for row in rows:
+            per_channel.setdefault(row["channel_id"], []).append(row)
+        # Fixed lock order so concurrent batches on other workers can't deadlock
+        for channel_id, channel_rows in sorted(per_channel.items()):
+            result = await db.execute(
+                update(Channel)
+                .where(Channel.id == channel_id)
+                .values(last_message_seq=Channel.last_message_seq + len(channel_rows))
+                .returning(Channel.last_message_seq)
+            )
+            last_seq = result.scalar()
+            if last_seq is None:
+                raise ValueError(f"Channel {channel_id} does not exist")
+            for offset, row in enumerate(channel_rows):
+                row["seq"] = last_seq - len(channel_rows) + 1 + offset
+
+    async def _count_unread_dms(self, db, rows: List[dict]):
+        """Add the new DMs to the recipients' unread counters."""
+        counts: Dict[Tuple, int] = {}
+        first: Dict[Tuple, datetime.datetime] = {}
+        for row in rows:
+            key = (row["recipient_id"], row["sender_id"])
+            counts[key] = counts.get(key, 0) + 1
+            first[key] = min(first.get(key, row["created_at"]), row["created_at"])
+        # A new conversation is read up to just before its first message (see AckBuffer)
+        stmt = pg_insert(ReadState).values([{
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "dm_other_user_id": other_id,
+            "unread_count": count,
+            "last_read_at": first[(user_id, other_id)] - datetime.timedelta(microseconds=1)
+        } for (user_id, other_id), count in sorted(counts.items())])
+        await db.execute(stmt.on_conflict_do_update(
+            constraint="uq_read_state_user_dm",
+            set_={"unread_count": ReadState.unread_count + stmt.excluded.unread_count}
+        ))
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,46 @@
+"""
+Keyset (cursor) pagination for message history.
+
+Pages are positioned on a (created_at, id) key rather than an OFFSET, so
+fetching any page is a single index range scan regardless of how deep in
+the history it is.
+"""
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+Cursor = Tuple  # (created_at, id) of the message the page is anchored on
+
+
+async def keyset_page(
+    db: AsyncSession,
+    stmt: Select,
+    created_at_col,
+    id_col,
+    limit: int,
+    before: Optional[Cursor] = None,
+    after: Optional[Cursor] = None,
+    around: Optional[Cursor] = None
+) -> List:
+    """
+    Run `stmt` for one page and return its rows oldest first. Without a cursor
+    this is the newest `limit` rows; `around` includes the anchor itself.
+    """
+    key = tuple_(created_at_col, id_col)
+    newest_first = (created_at_col.desc(), id_col.desc())
+    oldest_first = (created_at_col.asc(), id_col.asc())
+
+    if around is not None:
+        older = await db.execute(stmt.where(key < tuple_(*around)).order_by(*newest_first).limit(limit // 2))
+        newer = await db.execute(stmt.where(key >= tuple_(*around)).order_by(*oldest_first).limit(limit - limit // 2))
+        return list(reversed(older.scalars().all())) + list(newer.scalars().all())
+
+    if after is not None:
+        result = await db.execute(stmt.where(key > tuple_(*after)).order_by(*oldest_first).limit(limit))
+        return list(result.scalars().all())
+
+    if before is not None:
+        stmt = stmt.where(key < tuple_(*before))
+    result = await db.execute(stmt.order_by(*newest_first).limit(limit))
+    return list(reversed(result.scalars().all()))
@@ -0,0 +1,67 @@
+"""
+Effective server permissions of a member.
+
+A member's bitmask is the owner's ADMINISTRATOR bit, or the default member
+permissions OR'd with the permissions of all their roles. It is computed
+with one query and cached per (server, user) until a role or membership
+change invalidates it (ConnectionManager.invalidate_permissions).
+"""
+import uuid
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.permissions import (
+    Permission, DEFAULT_MEMBER_PERMISSIONS, OWNER_PERMISSIONS, compute_permissions, has_permission
+)
+from app.models.server import Server, ServerMember, ServerRole, member_role_association
+
+# (server_id, user_id) -> bitmask; 0 means "not a member"
+permission_cache = TTLCache(settings.PERMISSION_CACHE_SIZE, settings.PERMISSION_CACHE_TTL)
+
+
+def member_permissions(is_owner: bool, role_permissions: Optional[Iterable[Optional[int]]]) -> int:
+    """Server bitmask from the owner flag and the member's role bitmasks (None: not a member)."""
+    if is_owner:
+        return OWNER_PERMISSIONS
+    if role_permissions is None:
+        return 0
+    return DEFAULT_MEMBER_PERMISSIONS | compute_permissions([perms for perms in role_permissions if perms])
+
+
+async def get_member_permissions(db: AsyncSession, server: Server, user_id: uuid.UUID) -> int:
+    """Compute (or return the cached) permission bitmask of a user on a server."""
+    if server.owner_id == user_id:
+        return member_permissions(True, None)
+
+    key = (str(server.id), str(user_id))
+    cached = permission_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(
+        select(ServerMember.id, ServerRole.permissions)
+        .outerjoin(member_role_association, member_role_association.c.member_id == ServerMember.id)
+        .outerjoin(ServerRole, ServerRole.id == member_role_association.c.role_id)
+        .where(ServerMember.server_id == server.id, ServerMember.user_id == user_id)
+    )
+    rows = result.all()
+    permissions = member_permissions(False, [perms for _, perms in rows] if rows else None)
+    permission_cache.set(key, permissions)
+    return permissions
+
+
+async def check_permission(db: AsyncSession, server: Server, user_id: uuid.UUID, required_permission: int) -> bool:
+    """True if the user holds `required_permission` (or is an administrator) on the server."""
+    return has_permission(await get_member_permissions(db, server, user_id), required_permission)
+
+
+def invalidate_permissions(server_id: str, user_id: Optional[str] = None):
+    """Forget cached permissions of one member, or of every member of a server."""
+    if user_id is not None:
+        permission_cache.delete((server_id, user_id))
+    else:
+        permission_cache.delete_where(lambda key: key[0] == server_id)
@@ -124,6 +124,40 @@ def compute_permissions(role_permissions_list: list[int]) -> int:
     return combined
 
 
+def apply_overwrites(
+    base_permissions: int,
+    everyone_overwrite: tuple[int, int] = None,
+    role_overwrites: list[tuple[int, int]] = (),
+    member_overwrite: tuple[int, int] = None
+) -> int:
+    """
+    Apply channel permission overwrites to a member's server permissions.
+    
+    Each overwrite is an (allow, deny) pair. They are applied in order:
+    @everyone, then all of the member's roles combined, then the member itself,
+    with deny before allow at each step. Administrators are never restricted.
+    """
+    if base_permissions & Permission.ADMINISTRATOR:
+        return base_permissions
+    
+    permissions = base_permissions
+    if everyone_overwrite:
+        allow, deny = everyone_overwrite
+        permissions = (permissions & ~deny) | allow
+    
+    role_allow = role_deny = 0
+    for allow, deny in role_overwrites:
+        role_allow |= allow
+        role_deny |= deny
+    permissions = (permissions & ~role_deny) | role_allow
+    
+    if member_overwrite:
+        allow, deny = member_overwrite
+        permissions = (permissions & ~deny) | allow
+    
+    return permissions
+
+
 def permission_to_string(permission: int) -> list[str]:
     """Convert permission bitmask to list of permission names."""
     names = []
@@ -0,0 +1,183 @@
+"""
+Thumbnails and placeholders for image attachments.
+
+When a new image is stored, a background job decodes it once in a process
+pool (so neither the event loop nor the GIL is held), writes a WebP
+thumbnail of at most PREVIEW_MAX_SIZE pixels next to the object, computes a
+BlurHash placeholder, and records the original dimensions. Clients can then
+lay out and render chat previews from kilobytes instead of the full file.
+
+Needs Pillow (`pip install -e .[images]`); without it uploads simply get no
+preview.
+"""
+import asyncio
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, update
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.storage import object_url
+from app.models.attachment import Attachment
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+BLURHASH_COMPONENTS = (4, 3)
+BLURHASH_SAMPLE_SIZE = 32  # the placeholder is computed from a 32x32 copy
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def wants_preview(attachment: Attachment) -> bool:
+    return (
+        Image is not None
+        and attachment.thumbnail_path is None
+        and (attachment.content_type or "").startswith("image/")
+        and attachment.content_type != "image/svg+xml"
+    )
+
+
+def preview_fields(attachment: Attachment) -> dict:
+    """Preview data for API responses and message payloads (None until the job has run)."""
+    return {
+        "width": attachment.width,
+        "height": attachment.height,
+        "preview_url": object_url(attachment.thumbnail_path) if attachment.thumbnail_path else None,
+        "blurhash": attachment.blurhash
+    }
+
+
+async def generate_preview(sha256: str, user_id: Optional[str] = None):
+    """Render the preview of a stored image and tell the uploader (`user_id`) when it is ready."""
+    async with AsyncSessionLocal() as db:
+        attachment = (await db.execute(select(Attachment).where(Attachment.sha256 == sha256))).scalars().first()
+    if attachment is None or not wants_preview(attachment):
+        return
+
+    thumbnail_path = os.path.splitext(attachment.path)[0] + ".thumb.webp"
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.PREVIEW_WORKERS)
+    width, height, blurhash = await asyncio.get_running_loop().run_in_executor(
+        _pool, render_preview,
+        os.path.join(settings.UPLOAD_DIR, attachment.path),
+        os.path.join(settings.UPLOAD_DIR, thumbnail_path),
+        settings.PREVIEW_MAX_SIZE
+    )
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Attachment)
+            .where(Attachment.sha256 == sha256)
+            .values(width=width, height=height, thumbnail_path=thumbnail_path, blurhash=blurhash)
+        )
+        await db.commit()
+    attachment.width = width
+    attachment.height = height
+    attachment.thumbnail_path = thumbnail_path
+    attachment.blurhash = blurhash
+
+    if user_id:
+        from app.websockets.manager import manager
+        await manager.send_personal_message({
+            "type": "attachment_preview",
+            "url": object_url(attachment.path),
+            "sha256": sha256,
+            **preview_fields(attachment)
+        }, user_id)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# ============ Runs in the process pool ============
+
+def render_preview(source: str, target: str, max_size: int) -> Tuple[int, int, str]:
+    """Write a WebP thumbnail of `source` to `target`; return (width, height, blurhash) of the original."""
+    with Image.open(source) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):  # EXIF orientation with a 90 degree turn
+            width, height = height, width
+        # Let JPEG decode at a reduced scale when it can
+        image.draft("RGB", (max_size, max_size))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((max_size, max_size))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        thumbnail.save(target + ".tmp", "WEBP", quality=80)
+        os.replace(target + ".tmp", target)
+
+        sample = image.resize((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+        blurhash = blurhash_encode(
+            list(sample.getdata()), BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE, *BLURHASH_COMPONENTS
+        )
+    return width, height, blurhash
+
+
+def blurhash_encode(pixels: Sequence[Tuple[int, int, int]], width: int, height: int, x_components: int, y_components: int) -> str:
+    """BlurHash (https://blurha.sh) of row-major RGB pixels."""
+    linear = [(_to_linear(r), _to_linear(g), _to_linear(b)) for r, g, b in pixels]
+    factors: List[Tuple[float, float, float]] = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                cos_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = cos_y * math.cos(math.pi * i * x / width)
+                    pr, pg, pb = linear[y * width + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = int(max(0, min(82, math.floor(actual_max * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += _base83(0, 1)
+
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (int(max(0, min(18, math.floor(_sign_pow(c / maximum, 0.5) * 9 + 9.5)))) for c in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
@@ -0,0 +1,99 @@
+"""
+In-memory index of active bans and timeouts.
+
+Loaded from the infractions table at startup and then kept current by the
+moderation endpoints and the expiry job through gateway events (so every
+worker applies the same change). The send path asks it instead of the
+database; entries carry their expires_at, so a sanction that has run out is
+ignored even before the expiry job gets to it.
+"""
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import or_, select
+
+from app.core.database import AsyncSessionLocal
+from app.models.infraction import Infraction, PunishmentType
+
+BAN = PunishmentType.BAN.value
+TIMEOUT = PunishmentType.TIMEOUT.value
+
+
+def _active_infractions(*criteria):
+    return select(Infraction.type, Infraction.server_id, Infraction.user_id, Infraction.expires_at).where(
+        Infraction.is_active == "true",
+        Infraction.type.in_([PunishmentType.BAN, PunishmentType.TIMEOUT]),
+        or_(Infraction.expires_at.is_(None), Infraction.expires_at > datetime.utcnow()),
+        *criteria
+    )
+
+
+def _merge(active: Dict, key: Tuple[str, str, str], expires_at: Optional[datetime]):
+    """Overlapping sanctions of one kind: the longest one wins."""
+    if key in active:
+        current = active[key]
+        if current is None or (expires_at is not None and expires_at <= current):
+            return
+    active[key] = expires_at
+
+
+class SanctionsIndex:
+    """(kind, server_id, user_id) -> expires_at (None for permanent)."""
+
+    def __init__(self):
+        self._active: Dict[Tuple[str, str, str], Optional[datetime]] = {}
+
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(_active_infractions())
+            active = {}
+            for kind, server_id, user_id, expires_at in result.all():
+                _merge(active, (kind.value, str(server_id), str(user_id)), expires_at)
+        self._active = active
+        print(f"DEBUG: Loaded {len(active)} active sanctions")
+
+    def add(self, kind: str, server_id: str, user_id: str, expires_at: Optional[datetime] = None):
+        _merge(self._active, (kind, server_id, user_id), expires_at)
+
+    def remove(self, kind: str, server_id: str, user_id: str, expires_at: datetime):
+        """A sanction ending at `expires_at` expired; a longer overlapping one stays."""
+        key = (kind, server_id, user_id)
+        if key in self._active:
+            current = self._active[key]
+            if current is None or current > expires_at:
+                return
+        self._active.pop(key, None)
+
+    async def refresh(self, kind: str, server_id: str, user_id: str):
+        """Recompute one entry from the infractions still active (after a manual unban or lifted timeout)."""
+        key = (kind, server_id, user_id)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(_active_infractions(
+                Infraction.type == PunishmentType(kind),
+                Infraction.server_id == uuid.UUID(server_id),
+                Infraction.user_id == uuid.UUID(user_id)
+            ))
+            remaining = {}
+            for _, _, _, expires_at in result.all():
+                _merge(remaining, key, expires_at)
+        if key in remaining:
+            self._active[key] = remaining[key]
+        else:
+            self._active.pop(key, None)
+
+    def _is_active(self, kind: str, server_id: str, user_id: str) -> bool:
+        key = (kind, server_id, user_id)
+        if key not in self._active:
+            return False
+        expires_at = self._active[key]
+        return expires_at is None or expires_at > datetime.utcnow()
+
+    def is_banned(self, server_id: str, user_id: str) -> bool:
+        return self._is_active(BAN, server_id, user_id)
+
+    def is_timed_out(self, server_id: str, user_id: str) -> bool:
+        return self._is_active(TIMEOUT, server_id, user_id)
+
+
+sanctions = SanctionsIndex()
@@ -1,5 +1,8 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Any, Union
+from typing import Optional, Any, Callable, Union
 
 from jose import jwt
 from passlib.context import CryptContext
@@ -9,6 +12,24 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 ALGORITHM = settings.ALGORITHM
 
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+# Bounds how many hashes a worker accepts at once; the rest wait here, not in the pool
+_password_slots = asyncio.Semaphore(settings.PASSWORD_HASH_MAX_PENDING)
+
+# Counters for the password pool (queue time = submitted until a thread picked it up);
+# queue_time_max is since the last log_password_hash_stats()
+password_hash_stats = {
+    "calls": 0,
+    "in_flight": 0,
+    "queue_time_total": 0.0,
+    "queue_time_max": 0.0
+}
+_last_logged = {"calls": 0, "queue_time_total": 0.0}
+
 def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -24,3 +45,45 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+async def _run_password_work(func: Callable, *args):
+    submitted = time.monotonic()
+
+    def timed():
+        waited = time.monotonic() - submitted
+        password_hash_stats["queue_time_total"] += waited
+        password_hash_stats["queue_time_max"] = max(password_hash_stats["queue_time_max"], waited)
+        if waited > 1:
+            print(f"DEBUG: Password hash waited {waited:.2f}s for a worker thread")
+        return func(*args)
+
+    async with _password_slots:
+        password_hash_stats["calls"] += 1
+        password_hash_stats["in_flight"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_password_executor, timed)
+        finally:
+            password_hash_stats["in_flight"] -= 1
+
+async def log_password_hash_stats():
+    """Log the password pool's load since the last call (nothing when it was idle)."""
+    calls = password_hash_stats["calls"] - _last_logged["calls"]
+    if not calls and not password_hash_stats["in_flight"]:
+        return
+    waited = password_hash_stats["queue_time_total"] - _last_logged["queue_time_total"]
+    print(
+        f"DEBUG: Password pool: {calls} hashes, {password_hash_stats['in_flight']} in flight, "
+        f"queue time avg {waited / calls if calls else 0.0:.3f}s max {password_hash_stats['queue_time_max']:.3f}s "
+        f"({settings.PASSWORD_HASH_WORKERS} threads)"
+    )
+    _last_logged["calls"] = password_hash_stats["calls"]
+    _last_logged["queue_time_total"] = password_hash_stats["queue_time_total"]
+    password_hash_stats["queue_time_max"] = 0.0
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the password thread pool, for use in async handlers."""
+    return await _run_password_work(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the password thread pool, for use in async handlers."""
+    return await _run_password_work(get_password_hash, password)
@@ -0,0 +1,48 @@
+"""
+Serving of /uploads.
+
+Content-addressed objects (see app.core.storage) never change, so they are
+sent with their SHA-256 as a strong ETag and a year-long immutable
+Cache-Control: browsers and CDNs keep them without revalidating, and
+If-None-Match/If-Range match the ETag a client already holds. Derived files
+are other representations and get their own ETag ("<sha256>-thumb" for a
+preview thumbnail), so they never match the original's. Range requests
+(video seeking) and zero-copy sends (on servers offering the
+http.response.pathsend extension) come from Starlette's FileResponse.
+Files stored before content addressing keep Starlette's validators and a
+short max-age.
+"""
+import os
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.core.storage import OBJECT_PATH
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LEGACY_CACHE_CONTROL = "public, max-age=3600"
+
+
+class AttachmentFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = {"x-content-type-options": "nosniff"}
+        match = OBJECT_PATH.match(os.path.relpath(full_path, self.directory).replace(os.sep, "/"))
+        if match:
+            sha256, thumbnail = match.group(1), match.group(2)
+            headers["etag"] = f'"{sha256}-thumb"' if thumbnail else f'"{sha256}"'
+            headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            headers["cache-control"] = LEGACY_CACHE_CONTROL
+
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,209 @@
+"""
+Content-addressed attachment storage on the local disk.
+
+Every file is stored once under the SHA-256 of its bytes, sharded as
+UPLOAD_DIR/ab/cd/abcd...<ext>, and tracked by an Attachment row. Its
+ref_count is the number of stored rows whose text contains the object's URL
+(message and DM content or attachments, avatars, server icons): acquire()
+and release() are called in the transaction that writes, edits or deletes
+such a row. Objects left with no reference (never used after the upload, or
+whose last message was deleted) are removed by collect_garbage() once they
+have been unused for UPLOAD_ORPHAN_TTL seconds. Object URLs therefore never
+change meaning and can be cached forever.
+
+Uploads are copied in UPLOAD_CHUNK_SIZE chunks into UPLOAD_TMP_DIR: reads
+come from the upload (Starlette offloads them once the file has spilled to
+disk), writes run in a thread, and the SHA-256 is computed on the same pass.
+The event loop never blocks on the whole file. The request body itself is
+limited by BodySizeLimitMiddleware while it arrives; the copy enforces the
+exact file size. A duplicate is dropped from the temp dir instead of being
+written again.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from collections import Counter
+from datetime import timedelta
+from typing import Iterable, Optional, Set, Tuple
+
+from fastapi import UploadFile
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.attachment import Attachment
+
+URL_PREFIX = "/uploads/"
+OBJECT_URL = re.compile(r"/uploads/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})")
+OBJECT_PATH = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.thumb)?(\.[a-z0-9]+)?$")
+SAFE_EXT = re.compile(r"^\.[A-Za-z0-9]{1,15}$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def object_path(sha256: str, filename: Optional[str]) -> str:
+    """Path of an object relative to UPLOAD_DIR."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not SAFE_EXT.match(ext):
+        ext = ""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def object_url(path: str) -> str:
+    return URL_PREFIX + path
+
+
+async def stream_to_file(upload: UploadFile, path: str, max_bytes: int) -> Tuple[int, str]:
+    """
+    Copy `upload` to `path` and return (size, sha256 hex digest). Raises
+    UploadTooLarge (leaving nothing behind) once more than `max_bytes` were read.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge()
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(_remove, path)
+        raise
+    await asyncio.to_thread(out.close)
+    return size, digest.hexdigest()
+
+
+async def store_upload(db: AsyncSession, upload: UploadFile, max_bytes: int) -> Attachment:
+    """Store an upload (or reuse the object with identical content) and return its row."""
+    os.makedirs(settings.UPLOAD_TMP_DIR, exist_ok=True)
+    temp_path = os.path.join(settings.UPLOAD_TMP_DIR, uuid.uuid4().hex)
+    size, sha256 = await stream_to_file(upload, temp_path, max_bytes)
+    return await store_file(db, temp_path, size, sha256, upload.filename, upload.content_type)
+
+
+async def store_file(
+    db: AsyncSession,
+    temp_path: str,
+    size: int,
+    sha256: str,
+    filename: Optional[str],
+    content_type: Optional[str]
+) -> Attachment:
+    """
+    Move a fully written file from UPLOAD_TMP_DIR into the store (or drop it as
+    a duplicate). The object has no reference until a message uses its URL.
+    """
+    try:
+        stmt = pg_insert(Attachment).values(
+            id=uuid.uuid4(),
+            sha256=sha256,
+            path=object_path(sha256, filename),
+            size=size,
+            content_type=content_type,
+            ref_count=0
+        )
+        # Restart the grace period of an unreferenced object uploaded again
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Attachment.sha256],
+            set_={"last_used_at": func.now()}
+        ).returning(Attachment)
+        attachment = (await db.execute(stmt, execution_options={"populate_existing": True})).scalars().one()
+        # Still holding the row lock, so collect_garbage() can't remove the file under us
+        await asyncio.to_thread(_place, temp_path, os.path.join(settings.UPLOAD_DIR, attachment.path))
+        await db.commit()
+    except BaseException:
+        await asyncio.to_thread(_remove, temp_path)
+        raise
+    return attachment
+
+
+def referenced_hashes(*texts: Optional[str]) -> Set[str]:
+    """SHA-256s of the stored objects whose URLs appear in `texts` (a thumbnail counts as its object)."""
+    hashes = set()
+    for text in texts:
+        if text:
+            hashes.update(OBJECT_URL.findall(text))
+    return hashes
+
+
+async def acquire(db: AsyncSession, hashes: Iterable[str]):
+    """Take one reference per occurrence in `hashes`. Part of the caller's transaction."""
+    for sha256, count in sorted(Counter(hashes).items()):
+        await db.execute(
+            update(Attachment)
+            .where(Attachment.sha256 == sha256)
+            .values(ref_count=Attachment.ref_count + count)
+        )
+
+
+async def release(db: AsyncSession, hashes: Iterable[str]):
+    """Drop one reference per occurrence in `hashes`. Part of the caller's transaction."""
+    for sha256, count in sorted(Counter(hashes).items()):
+        await db.execute(
+            update(Attachment)
+            .where(Attachment.sha256 == sha256)
+            .values(ref_count=func.greatest(Attachment.ref_count - count, 0), last_used_at=func.now())
+        )
+
+
+async def update_references(db: AsyncSession, old: Set[str], new: Set[str]):
+    """Move the references of a row whose text changed from `old` to `new` objects."""
+    await acquire(db, new - old)
+    await release(db, old - new)
+
+
+async def collect_garbage() -> int:
+    """Remove objects that have had no reference for UPLOAD_ORPHAN_TTL seconds."""
+    unused = (
+        Attachment.ref_count <= 0,
+        Attachment.last_used_at < func.now() - timedelta(seconds=settings.UPLOAD_ORPHAN_TTL)
+    )
+    removed = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            chunk = select(Attachment.id).where(*unused).limit(settings.PURGE_BATCH_SIZE)
+            result = await db.execute(
+                # Conditions repeated so a row referenced meanwhile is skipped
+                delete(Attachment).where(Attachment.id.in_(chunk), *unused)
+                .returning(Attachment.path, Attachment.thumbnail_path)
+            )
+            rows = result.all()
+            # Before the commit: a concurrent upload of the same content waits on the row lock
+            for path, thumbnail_path in rows:
+                await asyncio.to_thread(_remove, os.path.join(settings.UPLOAD_DIR, path))
+                if thumbnail_path:
+                    await asyncio.to_thread(_remove, os.path.join(settings.UPLOAD_DIR, thumbnail_path))
+            await db.commit()
+        removed += len(rows)
+        if len(rows) < settings.PURGE_BATCH_SIZE:
+            break
+    if removed:
+        print(f"DEBUG: Removed {removed} unreferenced attachments")
+    return removed
+
+
+def _place(temp_path: str, final_path: str):
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+        return
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,249 @@
+"""
+Resumable uploads.
+
+A session is two files in UPLOAD_TMP_DIR/sessions/<user id>: <id>.json with
+what the client announced (owner, filename, content type, total size) and
+<id>.part with the bytes received so far. Its length is the offset to resume
+from, so a dropped connection only costs the chunk in flight, and any worker
+on the host can take the next chunk: writes and finalize hold an exclusive
+flock() on the part file, so two workers can never append at the same
+offset. Once complete the part file is hashed and handed to the regular
+attachment store through a hard link, so a failed finalize can be retried.
+
+A user has at most UPLOAD_SESSION_MAX_PER_USER sessions open. Sessions
+untouched for UPLOAD_SESSION_TTL seconds are removed by sweep_sessions(), run
+every UPLOAD_SESSION_SWEEP_INTERVAL seconds as a periodic job.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import AsyncIterator, BinaryIO, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.storage import UploadTooLarge, store_file
+from app.models.attachment import Attachment
+
+
+class UploadSessionError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadSessionError):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadBusy(UploadSessionError):
+    """Another request (on any worker) is writing to or finalizing the session."""
+
+
+class TooManySessions(UploadSessionError):
+    pass
+
+
+def _session_dir() -> str:
+    return os.path.join(settings.UPLOAD_TMP_DIR, "sessions")
+
+
+def _user_dir(user_id: str) -> str:
+    return os.path.join(_session_dir(), uuid.UUID(user_id).hex)
+
+
+def _paths(session_id: uuid.UUID, user_id: str):
+    base = os.path.join(_user_dir(user_id), session_id.hex)
+    return base + ".json", base + ".part"
+
+
+class UploadSession:
+    def __init__(self, session_id: uuid.UUID, user_id: str, filename: str, content_type: Optional[str], size: int):
+        self.id = session_id
+        self.user_id = user_id
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.meta_path, self.part_path = _paths(session_id, user_id)
+
+    @property
+    def offset(self) -> int:
+        try:
+            return os.path.getsize(self.part_path)
+        except FileNotFoundError:
+            return 0
+
+    def to_dict(self) -> dict:
+        return {"id": str(self.id), "filename": self.filename, "size": self.size, "offset": self.offset}
+
+
+async def create_session(user_id: str, filename: str, content_type: Optional[str], size: int) -> UploadSession:
+    """Raises TooManySessions when the user already has UPLOAD_SESSION_MAX_PER_USER open."""
+    session = UploadSession(uuid.uuid4(), user_id, filename, content_type, size)
+    meta = {"user_id": user_id, "filename": filename, "content_type": content_type, "size": size}
+    await asyncio.to_thread(_create_files, session, json.dumps(meta))
+    return session
+
+
+def _create_files(session: UploadSession, meta: str):
+    user_dir = _user_dir(session.user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    if sum(name.endswith(".json") for name in os.listdir(user_dir)) >= settings.UPLOAD_SESSION_MAX_PER_USER:
+        raise TooManySessions(f"At most {settings.UPLOAD_SESSION_MAX_PER_USER} uploads can be in progress")
+    with open(session.part_path, "wb"):
+        pass
+    with open(session.meta_path, "w") as f:
+        f.write(meta)
+
+
+async def get_session(session_id: uuid.UUID, user_id: str) -> Optional[UploadSession]:
+    """The session, if it exists and belongs to `user_id`."""
+    meta_path, _ = _paths(session_id, user_id)
+    try:
+        meta = json.loads(await asyncio.to_thread(_read, meta_path))
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get("user_id") != user_id:
+        return None
+    return UploadSession(session_id, meta["user_id"], meta["filename"], meta.get("content_type"), meta["size"])
+
+
+async def write_chunk(session: UploadSession, offset: int, body: AsyncIterator[bytes]) -> int:
+    """
+    Append a request body at `offset` (which must be the current offset) and
+    return the new offset. Whatever arrived before a disconnect is kept.
+    Raises UploadBusy while another request holds the session.
+    """
+    out = await asyncio.to_thread(_open_locked, session.part_path)
+    try:
+        current = os.fstat(out.fileno()).st_size
+        if offset != current:
+            raise OffsetMismatch(current)
+        async for chunk in body:
+            if not chunk:
+                continue
+            current += len(chunk)
+            if current > session.size:
+                raise UploadTooLarge()
+            await asyncio.to_thread(out.write, chunk)
+    finally:
+        # Closing releases the lock (after the buffered bytes are written)
+        await asyncio.to_thread(out.close)
+        # Touch the metadata so the sweep sees the session as active
+        await asyncio.to_thread(_touch, session.meta_path)
+    return session.offset
+
+
+async def finalize(db: AsyncSession, session: UploadSession) -> Attachment:
+    """
+    Hash the completed upload and move it into the attachment store. If that
+    fails the session is left as it was, so the client can finalize again.
+    """
+    part = await asyncio.to_thread(_open_locked, session.part_path)
+    try:
+        offset = os.fstat(part.fileno()).st_size
+        if offset != session.size:
+            raise OffsetMismatch(offset)
+        sha256 = await asyncio.to_thread(_hash_file, session.part_path)
+        # store_file consumes its temp file, even on failure; give it a second name for the part
+        temp_path = os.path.join(settings.UPLOAD_TMP_DIR, uuid.uuid4().hex)
+        await asyncio.to_thread(_link_or_copy, session.part_path, temp_path)
+        attachment = await store_file(db, temp_path, session.size, sha256, session.filename, session.content_type)
+    finally:
+        await asyncio.to_thread(part.close)
+    await abort(session)
+    return attachment
+
+
+async def abort(session: UploadSession):
+    await asyncio.to_thread(_remove_session_files, session.meta_path, session.part_path)
+
+
+async def sweep_sessions():
+    """Remove sessions that have not received anything for UPLOAD_SESSION_TTL seconds."""
+    removed = await asyncio.to_thread(_sweep)
+    if removed:
+        print(f"DEBUG: Removed {removed} abandoned upload sessions")
+
+
+def _sweep() -> int:
+    cutoff = time.time() - settings.UPLOAD_SESSION_TTL
+    removed = 0
+    for root, _, names in os.walk(_session_dir()):
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(meta_path) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            part_path = meta_path[:-len(".json")] + ".part"
+            try:
+                # Skip a session that is being written to right now
+                _open_locked(part_path).close()
+            except UploadBusy:
+                continue
+            except FileNotFoundError:
+                pass
+            _remove_session_files(meta_path, part_path)
+            removed += 1
+    return removed
+
+
+def _open_locked(path: str) -> BinaryIO:
+    """
+    Open the part file for appending with an exclusive lock shared by all
+    processes. FileNotFoundError if the session was finalized or removed meanwhile.
+    """
+    f = os.fdopen(os.open(path, os.O_WRONLY | os.O_APPEND), "ab")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadBusy("Another request is writing to this upload")
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(settings.UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def _remove_session_files(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
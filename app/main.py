@@ -1,12 +1,48 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.config import settings
 from app.api.api import api_router
+from app.websockets.manager import manager
+from app.core.message_writer import message_writer
+from app.core.ack_buffer import ack_buffer
+from app.core import previews, security, storage, upload_sessions
+from app.core.jobs import job_queue
+from app.core.infraction_expiry import expiry_scheduler
+from app.core.sanctions import sanctions
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from app.core.static_files import AttachmentFiles
+from app.core.body_limit import BodySizeLimitMiddleware, MULTIPART_OVERHEAD
 import os
 
-app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Attach the gateway to its backplane (Redis when running several workers)
+    await manager.start()
+    # Batched writer for chat messages (flushes what is pending on shutdown)
+    await message_writer.start()
+    await ack_buffer.start()
+    # Active bans/timeouts checked on the send path
+    await sanctions.load()
+    # Background jobs (arq or in-process); lifts timeouts and temp bans when they expire
+    await job_queue.start()
+    await expiry_scheduler.start()
+    # Attachments nothing links to any more, abandoned resumable uploads
+    job_queue.every("collect_garbage", storage.collect_garbage, settings.UPLOAD_GC_INTERVAL)
+    job_queue.every("sweep_upload_sessions", upload_sessions.sweep_sessions, settings.UPLOAD_SESSION_SWEEP_INTERVAL)
+    # Load of this worker's bcrypt pool
+    job_queue.every(
+        "password_hash_stats", security.log_password_hash_stats, settings.PASSWORD_HASH_STATS_INTERVAL, in_process=True
+    )
+    yield
+    await expiry_scheduler.stop()
+    await job_queue.stop()
+    previews.shutdown()
+    await ack_buffer.stop()
+    await message_writer.stop()
+    await manager.stop()
+
+app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,13 +51,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Oversized uploads are refused while the body is still arriving
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/attachments/upload": settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD}
+)
 
 app.include_router(api_router)
 
 # Mount uploads directory
-if not os.path.exists("uploads"):
-    os.makedirs("uploads")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+if not os.path.exists(settings.UPLOAD_DIR):
+    os.makedirs(settings.UPLOAD_DIR)
+app.mount("/uploads", AttachmentFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
 @app.get("/")
 async def root():
@@ -5,5 +5,6 @@ from app.models.friendship import Friendship
 from app.models.direct_message import DirectMessage
 
 from app.models.read_state import ReadState
+from app.models.attachment import Attachment
 
-__all__ = ["User", "Server", "Channel", "Message", "Friendship", "DirectMessage", "ReadState"]
+__all__ = ["User", "Server", "Channel", "Message", "Friendship", "DirectMessage", "ReadState", "Attachment"]
@@ -0,0 +1,37 @@
+import uuid
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Index, text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class Attachment(Base):
+    """
+    One stored file, addressed by the SHA-256 of its content.
+    Uploading the same bytes again reuses the object; ref_count counts the
+    messages, avatars and icons that link to it.
+    """
+    __tablename__ = "attachments"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    path = Column(String, nullable=False)  # relative to UPLOAD_DIR, e.g. ab/cd/abcd...png
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # Images only, filled in by the preview job
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    thumbnail_path = Column(String, nullable=True)  # relative to UPLOAD_DIR
+    blurhash = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Last upload or lost reference; unreferenced objects are collected UPLOAD_ORPHAN_TTL after it
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Garbage collection of unreferenced objects
+        Index("idx_attachments_unreferenced", "last_used_at", postgresql_where=text("ref_count <= 0")),
+    )
+
+    def __repr__(self):
+        return f"<Attachment {self.sha256} x{self.ref_count}>"
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, String, ForeignKey, DateTime, Text, Boolean, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -21,3 +21,16 @@ class DirectMessage(Base):
     # Relationships
     sender = relationship("User", foreign_keys=[sender_id])
     recipient = relationship("User", foreign_keys=[recipient_id])
+
+# A conversation is keyed on its (lower, higher) participant pair regardless of direction
+conversation_low = func.least(DirectMessage.sender_id, DirectMessage.recipient_id)
+conversation_high = func.greatest(DirectMessage.sender_id, DirectMessage.recipient_id)
+
+# Index for cursor pagination within a conversation
+Index(
+    "idx_direct_messages_conversation",
+    conversation_low,
+    conversation_high,
+    DirectMessage.created_at,
+    DirectMessage.id
+)
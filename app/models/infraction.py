@@ -1,7 +1,7 @@
 import uuid
 import enum
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Enum, Text, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -38,5 +38,10 @@ class Infraction(Base):
     user = relationship("User", foreign_keys=[user_id], backref="infractions_received")
     moderator = relationship("User", foreign_keys=[moderator_id], backref="infractions_given")
 
+    __table_args__ = (
+        # Pending expiries (the scheduler's startup load and the sweep)
+        Index("idx_infractions_active_expiry", "expires_at", postgresql_where=text("is_active = 'true'")),
+    )
+
     def __repr__(self):
         return f"<Infraction {self.type.value} on {self.user_id} by {self.moderator_id}>"
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, String, ForeignKey, DateTime, Text, Boolean, Index, BigInteger
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -15,13 +15,14 @@ class Message(Base):
     attachments = Column(Text, nullable=True) # JSON string for now to avoid complexity, or JSONB if preferred
     reply_to_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete='SET NULL'), nullable=True)
     is_edited = Column(Boolean, default=False)
+    seq = Column(BigInteger, nullable=True)  # position in the channel, assigned when written
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     user = relationship("User")
     channel = relationship("Channel")
 
-    # Index for faster pagination
-    # __table_args__ = (
-    #     Index("idx_messages_channel_created", "channel_id", "created_at"),
-    # )
+    # Index for cursor pagination (id breaks ties between equal timestamps)
+    __table_args__ = (
+        Index("idx_messages_channel_created", "channel_id", "created_at", "id"),
+    )
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import Column, DateTime, ForeignKey, Index, UniqueConstraint, BigInteger, Integer
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -17,7 +17,12 @@ class ReadState(Base):
     # For DMs (context is "conversation with other_user")
     dm_other_user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
 
+    # Read position: created_at of the last message acked (see AckBuffer)
     last_read_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Channels: seq of the last message read
+    last_read_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
+    # DMs: messages received from dm_other_user after last_read_at
+    unread_count = Column(Integer, default=0, server_default="0", nullable=False)
     
     user = relationship("User", foreign_keys=[user_id])
     channel = relationship("Channel")
@@ -1,6 +1,6 @@
 import uuid
 import enum
-from sqlalchemy import Column, String, ForeignKey, Enum, Boolean, BigInteger, Table, DateTime
+from sqlalchemy import Column, String, ForeignKey, Enum, Boolean, BigInteger, Table, DateTime, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -40,8 +40,31 @@ class Channel(Base):
     name = Column(String, nullable=False)
     server_id = Column(UUID(as_uuid=True), ForeignKey("servers.id"), nullable=False)
     type = Column(Enum(ChannelType, name="channel_type"), default=ChannelType.TEXT, nullable=False)
+    # Sequence number of the latest message (unread = last_message_seq - ReadState.last_read_seq)
+    last_message_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
 
     server = relationship("Server", back_populates="channels")
+    permission_overwrites = relationship("ChannelPermissionOverwrite", back_populates="channel", cascade="all, delete-orphan")
+
+class OverwriteTargetType(str, enum.Enum):
+    ROLE = "ROLE"  # target_id is a ServerRole id, or the server id for @everyone
+    MEMBER = "MEMBER"  # target_id is a user id
+
+class ChannelPermissionOverwrite(Base):
+    __tablename__ = "channel_permission_overwrites"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    channel_id = Column(UUID(as_uuid=True), ForeignKey("channels.id", ondelete="CASCADE"), nullable=False, index=True)
+    target_type = Column(Enum(OverwriteTargetType, name="overwrite_target_type"), nullable=False)
+    target_id = Column(UUID(as_uuid=True), nullable=False)
+    allow = Column(BigInteger, default=0, nullable=False)  # Bitmask
+    deny = Column(BigInteger, default=0, nullable=False)  # Bitmask
+
+    channel = relationship("Channel", back_populates="permission_overwrites")
+
+    __table_args__ = (
+        UniqueConstraint("channel_id", "target_type", "target_id", name="uq_channel_overwrite_target"),
+    )
 
 class ServerRole(Base):
     __tablename__ = "server_roles"
@@ -0,0 +1,100 @@
+"""
+Backplanes carry gateway events between worker processes.
+
+Every ConnectionManager publishes its events to a backplane and delivers
+whatever the backplane hands back to its own sockets. The local backplane
+loops events straight back in-process (single worker, scripts, tests);
+the Redis backplane fans them out over pub/sub so every uvicorn worker
+sees every event.
+"""
+import asyncio
+import json
+from typing import Awaitable, Callable, Optional
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane:
+    """Base class. `handler` is called once per event received by this process."""
+
+    def __init__(self, handler: EventHandler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+
+class LocalBackplane(Backplane):
+    """In-process backplane: publish() hands the event straight to the handler."""
+
+    async def publish(self, event: dict):
+        await self.handler(event)
+
+
+class RedisBackplane(Backplane):
+    """
+    Redis pub/sub backplane.
+
+    Pass `client` to run against an existing connection (e.g. a fakeredis
+    instance in tests) instead of connecting to `url`.
+    """
+
+    def __init__(self, handler: EventHandler, url: str, channel: str, client=None):
+        super().__init__(handler)
+        self.url = url
+        self.channel = channel
+        self._redis = client
+        self._owns_client = client is None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(self.url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen())
+        print(f"DEBUG: Redis backplane subscribed to {self.channel}")
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._owns_client and self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def publish(self, event: dict):
+        await self._redis.publish(self.channel, json.dumps(event, default=str))
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        await self.handler(json.loads(message["data"]))
+                    except Exception as e:
+                        print(f"DEBUG: Backplane event failed: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Connection dropped; redis-py reconnects on the next read
+                print(f"DEBUG: Redis backplane listener error: {e}")
+                await asyncio.sleep(1)
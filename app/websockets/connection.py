@@ -0,0 +1,105 @@
+"""
+Outbound side of a gateway WebSocket.
+
+Each Connection owns a bounded queue of pre-encoded text frames drained by
+its own writer task, so broadcasting is a non-blocking enqueue and a slow
+client only ever delays itself.
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from fastapi import WebSocket, status
+
+from app.core.config import settings
+from app.websockets.encoding import encode_frame
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued event of the same kind
+DISCONNECT = "disconnect"  # the consumer is lagging: close the socket
+
+
+def overflow_policy(message_type: str) -> str:
+    """Ephemeral events (typing, presence) can be dropped; anything else means the client fell behind."""
+    if message_type in settings.WS_DROPPABLE_EVENTS:
+        return DROP_OLDEST
+    return DISCONNECT
+
+
+class Connection:
+    """A client socket with a bounded outbound queue and a dedicated writer task."""
+
+    def __init__(self, websocket: WebSocket, user_id: str, max_queue: int = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue or settings.WS_SEND_QUEUE_SIZE
+        self.closed = False
+        self.dropped = 0
+        self._queue: Deque[Tuple[str, str]] = deque()  # (event type, encoded frame)
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, message: dict) -> bool:
+        """Encode and queue a message meant for this socket only."""
+        return self.send_frame(encode_frame(message), message.get("type"))
+
+    def send_frame(self, frame: str, message_type: str = None) -> bool:
+        """Queue an already encoded frame. Never blocks; returns False if it was not queued."""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            if overflow_policy(message_type) == DISCONNECT or not self._drop_oldest(message_type):
+                print(f"DEBUG: Send queue of {self.user_id} is full, disconnecting lagging client")
+                self.close(status.WS_1013_TRY_AGAIN_LATER)
+                return False
+        self._queue.append((message_type, frame))
+        self._ready.set()
+        return True
+
+    def _drop_oldest(self, message_type: str) -> bool:
+        for queued in self._queue:
+            if queued[0] == message_type:
+                self._queue.remove(queued)
+                self.dropped += 1
+                return True
+        return False
+
+    def stop(self):
+        """Stop the writer once the client has gone away."""
+        self.closed = True
+        self._queue.clear()
+        if self._writer:
+            self._writer.cancel()
+            self._writer = None
+
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        """Stop the writer and close the socket; the reader loop then sees the disconnect."""
+        if self.closed:
+            return
+        self.stop()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                _, frame = self._queue.popleft()
+                await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"DEBUG: Writer for {self.user_id} stopped: {e}")
+            self.closed = True
+            self._queue.clear()
@@ -0,0 +1,21 @@
+"""
+JSON encoding for gateway frames.
+
+Broadcasts are encoded once and the same text frame is queued on every
+recipient socket. orjson is used when installed (`pip install -e .[speedups]`),
+otherwise the stdlib encoder with the same compact output as
+WebSocket.send_json.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def encode_frame(message: dict) -> str:
+    """Serialize an event into the text frame sent to clients."""
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
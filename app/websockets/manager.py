@@ -1,140 +1,597 @@
 import json
 import asyncio
-from typing import Dict, List, Set
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
 from fastapi import WebSocket
 
+from app.core.cache import user_cache
+from app.core.config import settings
+from app.core.permission_resolver import invalidate_permissions
+from app.core.channel_permissions import channel_engine
+from app.core.sanctions import sanctions
+from app.websockets.backplane import Backplane, LocalBackplane, RedisBackplane
+from app.websockets.connection import Connection
+from app.websockets.encoding import encode_frame
+
 class ConnectionManager:
     """
-    In-memory connection manager for local development.
+    Connection manager for the WebSocket gateway.
     Handles WebSocket connections, channel broadcasts, voice state, and user presence.
+
+    Channel fan-out goes through a subscription index: every socket is subscribed to
+    the channels its user can see (VIEW_CHANNELS after permission overwrites) in the
+    servers they belong to, so a broadcast only touches members allowed to read it.
+
+    Public send/update methods publish an event on the backplane; every worker
+    (including this one) receives it in `_handle_event` and delivers it to the
+    sockets it holds. With the local backplane this is a direct in-process call.
+
+    Delivery only enqueues onto each Connection's bounded send queue; the
+    connection's writer task does the actual socket I/O. Each payload is
+    encoded once (by the publisher for channel and personal messages) and the
+    same text frame is queued on every recipient.
+
+    Presence is only delivered to users who share a server or a friendship with
+    its subject, and a user's changes are coalesced into at most one update per
+    PRESENCE_COALESCE_SECONDS (a disconnect is held back for that long, so tab
+    reloads never show up as offline/online).
     """
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.worker_id = uuid.uuid4().hex
+        self.backplane: Backplane = LocalBackplane(self._handle_event)
+        self.active_connections: Dict[str, List[Connection]] = {}
         self.voice_occupants: Dict[str, List[dict]] = {}  # channel_id -> [{id, username, avatar}]
-        self.user_presence: Dict[str, str] = {}  # user_id -> status (online/idle/dnd/offline)
+        # Presence mirror of every online user, kept in sync across workers through presence events
+        self.user_presence: Dict[str, str] = {}  # user_id -> status (online/idle/dnd/invisible)
         self.user_info: Dict[str, dict] = {}  # user_id -> {username, avatar}
+        self.presence_sessions: Dict[str, Set[str]] = {}  # user_id -> worker_ids holding a socket
+        self.presence_servers: Dict[str, Set[str]] = {}  # user_id -> server_ids
+        self.presence_friends: Dict[str, Set[str]] = {}  # user_id -> friend user_ids
+        self.server_online: Dict[str, Set[str]] = {}  # server_id -> online user_ids
+        # Presence of users connected to this worker, before coalescing
+        self._presence_profiles: Dict[str, dict] = {}  # user_id -> {username, avatar, server_ids, friend_ids}
+        self._presence_desired: Dict[str, str] = {}  # user_id -> status waiting to be published
+        self._presence_sent: Dict[str, tuple] = {}  # user_id -> (status, monotonic time)
+        self._presence_timers: Dict[str, asyncio.Task] = {}
+        # Subscription index (only tracks servers with at least one connected member)
+        self.channel_subscribers: Dict[str, Set[Connection]] = {}  # channel_id -> connections
+        self.server_channels: Dict[str, Set[str]] = {}  # server_id -> channel_ids
+        self.server_users: Dict[str, Set[str]] = {}  # server_id -> connected user_ids
+        self.user_servers: Dict[str, Dict[str, Set[str]]] = {}  # user_id -> server_id -> visible channel_ids
         self._lock = asyncio.Lock()
 
-    async def connect(self, websocket: WebSocket, user_id: str, username: str = None, avatar: str = None):
+    async def start(self, backplane: Optional[Backplane] = None):
+        """Attach the configured backplane. Call once per worker at startup."""
+        if backplane is None and settings.GATEWAY_BACKPLANE == "redis":
+            backplane = RedisBackplane(self._handle_event, settings.REDIS_URL, settings.GATEWAY_REDIS_CHANNEL)
+        if backplane is not None:
+            self.backplane = backplane
+        await self.backplane.start()
+
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def _publish(self, op: str, **fields):
+        await self.backplane.publish({"op": op, **fields})
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        username: str = None,
+        avatar: str = None,
+        servers: Dict[str, Iterable[str]] = None,
+        friends: Iterable[str] = None
+    ) -> Connection:
+        """
+        Register a socket and start its writer. `servers` maps each server the
+        user belongs to onto its channel IDs and seeds the subscription index;
+        `servers` and `friends` also decide who sees this user's presence.
+        """
+        connection = Connection(websocket, user_id)
+        connection.start()
         async with self._lock:
             was_offline = user_id not in self.active_connections or len(self.active_connections.get(user_id, [])) == 0
             if user_id not in self.active_connections:
                 self.active_connections[user_id] = []
-            self.active_connections[user_id].append(websocket)
-            
-            # Track user info for presence broadcasts
-            if username:
-                self.user_info[user_id] = {"username": username, "avatar": avatar}
-            
-            # Set online if was offline
-            if was_offline:
-                self.user_presence[user_id] = "online"
-                print(f"DEBUG: User {user_id} ({username}) is now ONLINE")
-                await self._broadcast_presence(user_id, "online")
-            
+            self.active_connections[user_id].append(connection)
+
+            for server_id, channel_ids in (servers or {}).items():
+                self._add_membership(user_id, server_id, channel_ids)
+            for server_id in self.user_servers.get(user_id, ()):
+                self._subscribe_socket(connection, server_id)
+
             print(f"DEBUG: User {user_id} connected. Total users online: {len(self.active_connections)}")
 
-    def disconnect(self, websocket: WebSocket, user_id: str):
+        # Set online if was offline on this worker (keeping a status set through another worker)
+        if was_offline:
+            print(f"DEBUG: User {user_id} ({username}) is now ONLINE")
+            self._presence_profiles[user_id] = {
+                "username": username or "",
+                "avatar": avatar or "",
+                "server_ids": set((servers or {}).keys()),
+                "friend_ids": set(friends or ())
+            }
+            self._queue_presence(user_id, self.user_presence.get(user_id, "online"))
+        return connection
+
+    def disconnect(self, connection: Connection, user_id: str):
+        connection.stop()
         if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
+            if connection in self.active_connections[user_id]:
+                self.active_connections[user_id].remove(connection)
+            for server_id in self.user_servers.get(user_id, ()):
+                self._unsubscribe_socket(connection, server_id)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
-                self.user_presence[user_id] = "offline"
+                for server_id in list(self.user_servers.get(user_id, ())):
+                    self._remove_membership(user_id, server_id)
+                self.user_servers.pop(user_id, None)
                 print(f"DEBUG: User {user_id} is now OFFLINE")
-                # Schedule presence broadcast (can't await in sync method)
-                asyncio.create_task(self._broadcast_presence(user_id, "offline"))
+                self._queue_presence(user_id, "offline")
             print(f"DEBUG: User {user_id} disconnected. Remaining users: {len(self.active_connections)}")
 
+    async def set_status(self, user_id: str, status: str):
+        """Change the status of a connected user."""
+        if self._is_connected_here(user_id):
+            self._queue_presence(user_id, status)
+
     def get_online_user_ids(self) -> List[str]:
         """Get list of all online user IDs"""
-        return list(self.active_connections.keys())
+        return list(self.user_presence.keys())
 
     def is_online(self, user_id: str) -> bool:
+        return user_id in self.user_presence
+
+    def _is_connected_here(self, user_id: str) -> bool:
         return user_id in self.active_connections and len(self.active_connections[user_id]) > 0
 
-    async def _broadcast_presence(self, user_id: str, status: str):
-        """Broadcast presence change to all connected users"""
-        info = self.user_info.get(user_id, {})
-        message = {
+    # ============ Subscription Index ============
+
+    def _subscribe_socket(self, connection: Connection, server_id: str, channel_ids: Iterable[str] = None):
+        if channel_ids is None:
+            channel_ids = self.user_servers.get(connection.user_id, {}).get(server_id, ())
+        for channel_id in channel_ids:
+            self.channel_subscribers.setdefault(channel_id, set()).add(connection)
+
+    def _unsubscribe_socket(self, connection: Connection, server_id: str, channel_ids: Iterable[str] = None):
+        if channel_ids is None:
+            channel_ids = self.user_servers.get(connection.user_id, {}).get(server_id, ())
+        for channel_id in channel_ids:
+            subscribers = self.channel_subscribers.get(channel_id)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.channel_subscribers[channel_id]
+
+    def _add_membership(self, user_id: str, server_id: str, channel_ids: Iterable[str]):
+        self.user_servers.setdefault(user_id, {})[server_id] = set(channel_ids)
+        self.server_users.setdefault(server_id, set()).add(user_id)
+        self.server_channels.setdefault(server_id, set()).update(channel_ids)
+
+    def _remove_membership(self, user_id: str, server_id: str):
+        """Drop a user from a server's index, forgetting the server once nobody connected is left in it."""
+        servers = self.user_servers.get(user_id)
+        if servers is not None:
+            servers.pop(server_id, None)
+        users = self.server_users.get(server_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.server_users[server_id]
+                for channel_id in self.server_channels.pop(server_id, ()):
+                    self.channel_subscribers.pop(channel_id, None)
+
+    def _set_visible_channels(self, user_id: str, server_id: str, channel_ids: Iterable[str]):
+        """Re-subscribe a connected member's sockets after their visible channels changed."""
+        current = self.user_servers.get(user_id, {}).get(server_id)
+        if current is None:
+            return
+        visible = set(channel_ids)
+        hidden, shown = current - visible, visible - current
+        for connection in self.active_connections.get(user_id, []):
+            self._unsubscribe_socket(connection, server_id, hidden)
+            self._subscribe_socket(connection, server_id, shown)
+        self.user_servers[user_id][server_id] = visible
+        self.server_channels.setdefault(server_id, set()).update(visible)
+
+    async def join_server(self, user_id: str, server_id: str, channel_ids: Iterable[str]):
+        """Subscribe a user's open sockets to every channel of a server they just joined."""
+        await self._publish("join_server", user_id=user_id, server_id=server_id, channel_ids=list(channel_ids))
+
+    async def leave_server(self, user_id: str, server_id: str):
+        """Unsubscribe a user who left, was kicked or was banned from a server."""
+        await self._publish("leave_server", user_id=user_id, server_id=server_id)
+
+    async def add_channel(self, server_id: str, channel_id: str):
+        """Subscribe connected members of a server to a newly created channel."""
+        await self._publish("add_channel", server_id=server_id, channel_id=channel_id)
+
+    async def remove_server(self, server_id: str):
+        """Drop all subscriptions of a deleted server."""
+        await self._publish("remove_server", server_id=server_id)
+
+    async def _on_join_server(self, user_id: str, server_id: str, channel_ids: List[str]):
+        if user_id in self.user_presence:
+            # New co-members and the joining user learn about each other
+            self.presence_servers.setdefault(user_id, set()).add(server_id)
+            members = self.server_online.setdefault(server_id, set())
+            self._deliver_presence(user_id, members)
+            for member_id in list(members):
+                self._deliver_presence(member_id, [user_id])
+            members.add(user_id)
+        if user_id in self._presence_profiles:
+            self._presence_profiles[user_id]["server_ids"].add(server_id)
+        state = channel_engine.loaded(server_id)
+        if state is not None:
+            state.set_member(user_id, state.members.get(user_id, ()))
+        if not self._is_connected_here(user_id):
+            return
+        if state is None:
+            state = await channel_engine.get(server_id)
+        if state is not None:
+            channel_ids = state.visible_channels(user_id)
+        self._add_membership(user_id, server_id, channel_ids)
+        for connection in self.active_connections[user_id]:
+            self._subscribe_socket(connection, server_id)
+
+    def _on_leave_server(self, user_id: str, server_id: str):
+        self.presence_servers.get(user_id, set()).discard(server_id)
+        self.server_online.get(server_id, set()).discard(user_id)
+        if user_id in self._presence_profiles:
+            self._presence_profiles[user_id]["server_ids"].discard(server_id)
+        state = channel_engine.loaded(server_id)
+        if state is not None:
+            state.set_member(user_id, None)
+        if server_id not in self.user_servers.get(user_id, ()):
+            return
+        for connection in self.active_connections.get(user_id, []):
+            self._unsubscribe_socket(connection, server_id)
+        self._remove_membership(user_id, server_id)
+
+    async def _on_add_channel(self, server_id: str, channel_id: str):
+        channel_engine.channel_servers[channel_id] = server_id
+        state = channel_engine.loaded(server_id)
+        if state is not None:
+            state.set_overwrites(channel_id, {})
+        if server_id not in self.server_channels:
+            return
+        if state is None:
+            state = await channel_engine.get(server_id)
+        self.server_channels[server_id].add(channel_id)
+        for user_id in self.server_users.get(server_id, ()):
+            if state is not None and not state.can_view(channel_id, user_id):
+                continue
+            self.user_servers[user_id][server_id].add(channel_id)
+            for connection in self.active_connections.get(user_id, []):
+                self._subscribe_socket(connection, server_id, [channel_id])
+
+    def _on_remove_server(self, server_id: str):
+        for user_id in self.server_online.pop(server_id, ()):
+            self.presence_servers.get(user_id, set()).discard(server_id)
+        for profile in self._presence_profiles.values():
+            profile["server_ids"].discard(server_id)
+        for channel_id in self.server_channels.pop(server_id, ()):
+            self.channel_subscribers.pop(channel_id, None)
+        for user_id in self.server_users.pop(server_id, ()):
+            servers = self.user_servers.get(user_id)
+            if servers is not None:
+                servers.pop(server_id, None)
+        channel_engine.forget(server_id)
+
+    # ============ Presence ============
+
+    async def add_friendship(self, user_id: str, friend_id: str):
+        """Let two users see each other's presence once they become friends."""
+        await self._publish("friendship", user_id=user_id, friend_id=friend_id, added=True)
+
+    async def remove_friendship(self, user_id: str, friend_id: str):
+        await self._publish("friendship", user_id=user_id, friend_id=friend_id, added=False)
+
+    def _on_friendship(self, user_id: str, friend_id: str, added: bool):
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            if a in self._presence_profiles:
+                if added:
+                    self._presence_profiles[a]["friend_ids"].add(b)
+                else:
+                    self._presence_profiles[a]["friend_ids"].discard(b)
+            if a in self.user_presence:
+                if added:
+                    self.presence_friends.setdefault(a, set()).add(b)
+                    if b in self.user_presence:
+                        self._deliver_presence(a, [b])
+                else:
+                    self.presence_friends.get(a, set()).discard(b)
+
+    def _queue_presence(self, user_id: str, status: str):
+        """
+        Coalesce presence changes of a locally connected user. Going offline waits a
+        full window (a quick reconnect cancels it); other changes go out at once unless
+        an update was already published within the window.
+        """
+        self._presence_desired[user_id] = status
+        if user_id in self._presence_timers:
+            return
+        window = settings.PRESENCE_COALESCE_SECONDS
+        last = self._presence_sent.get(user_id)
+        if status == "offline":
+            delay = window
+        elif last is None:
+            delay = 0
+        else:
+            delay = max(0, window - (time.monotonic() - last[1]))
+        self._presence_timers[user_id] = asyncio.create_task(self._flush_presence(user_id, delay))
+
+    async def _flush_presence(self, user_id: str, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        self._presence_timers.pop(user_id, None)
+        status = self._presence_desired.pop(user_id, None)
+        last = self._presence_sent.get(user_id)
+        if status is None or (last is not None and last[0] == status):
+            return
+        if status == "offline":
+            self._presence_sent.pop(user_id, None)
+            self._presence_profiles.pop(user_id, None)
+            await self._publish("presence", user_id=user_id, status="offline", worker_id=self.worker_id)
+            return
+        self._presence_sent[user_id] = (status, time.monotonic())
+        profile = self._presence_profiles.get(user_id, {})
+        await self._publish(
+            "presence",
+            user_id=user_id,
+            status=status,
+            username=profile.get("username", ""),
+            avatar=profile.get("avatar", ""),
+            server_ids=list(profile.get("server_ids", ())),
+            friend_ids=list(profile.get("friend_ids", ())),
+            worker_id=self.worker_id
+        )
+
+    async def _on_presence(self, event: dict):
+        """Update the presence mirror and tell local sockets when the user's effective status changed."""
+        user_id = event["user_id"]
+        status = event["status"]
+        sessions = self.presence_sessions.setdefault(user_id, set())
+        if status == "offline":
+            sessions.discard(event["worker_id"])
+            if sessions:
+                # Still connected through another worker
+                return
+            audience = self._presence_audience(user_id)
+            del self.presence_sessions[user_id]
+            self.user_presence.pop(user_id, None)
+            self.user_info.pop(user_id, None)
+            self.presence_friends.pop(user_id, None)
+            for server_id in self.presence_servers.pop(user_id, ()):
+                members = self.server_online.get(server_id)
+                if members is not None:
+                    members.discard(user_id)
+                    if not members:
+                        del self.server_online[server_id]
+            self._send_presence(user_id, "offline", {}, audience)
+            return
+        sessions.add(event["worker_id"])
+        self.user_presence[user_id] = status
+        self.user_info[user_id] = {"username": event.get("username", ""), "avatar": event.get("avatar", "")}
+        self.presence_friends[user_id] = set(event.get("friend_ids", ()))
+        for server_id in self.presence_servers.get(user_id, set()) - set(event.get("server_ids", ())):
+            self.server_online.get(server_id, set()).discard(user_id)
+        self.presence_servers[user_id] = set(event.get("server_ids", ()))
+        for server_id in self.presence_servers[user_id]:
+            self.server_online.setdefault(server_id, set()).add(user_id)
+        self._deliver_presence(user_id, self._presence_audience(user_id))
+
+    def _presence_audience(self, user_id: str) -> Set[str]:
+        """Online users who share a server or a friendship with the user (plus the user)."""
+        audience = {user_id}
+        for server_id in self.presence_servers.get(user_id, ()):
+            audience.update(self.server_online.get(server_id, ()))
+        audience.update(self.presence_friends.get(user_id, ()))
+        return audience
+
+    def _deliver_presence(self, user_id: str, audience: Iterable[str]):
+        status = self.user_presence.get(user_id)
+        if status is not None:
+            self._send_presence(user_id, status, self.user_info.get(user_id, {}), audience)
+
+    def _send_presence(self, user_id: str, status: str, info: dict, audience: Iterable[str]):
+        """Queue a presence update on the local connections of the audience"""
+        frame = encode_frame({
             "type": "presence_update",
             "user_id": user_id,
             "status": status,
             "username": info.get("username", ""),
             "avatar": info.get("avatar", "")
-        }
-        for uid, connections in self.active_connections.items():
-            for ws in connections:
-                try:
-                    await ws.send_json(message)
-                except:
-                    pass
-
-    async def broadcast_full_presence(self, websocket: WebSocket):
-        """Send current presence state of all users to a newly connected client"""
+        })
+        for uid in audience:
+            for connection in self.active_connections.get(uid, ()):
+                connection.send_frame(frame, "presence_update")
+
+    def broadcast_full_presence(self, connection: Connection):
+        """Send the presence of everyone the newly connected user can see"""
+        profile = self._presence_profiles.get(connection.user_id, {})
+        visible = {connection.user_id}
+        for server_id in profile.get("server_ids", ()):
+            visible.update(self.server_online.get(server_id, ()))
+        visible.update(profile.get("friend_ids", ()))
         online_users = []
-        for uid in self.active_connections:
+        for uid in visible:
+            status = self.user_presence.get(uid)
+            if status is None:
+                continue
             info = self.user_info.get(uid, {})
             online_users.append({
                 "user_id": uid,
-                "status": self.user_presence.get(uid, "online"),
+                "status": status,
                 "username": info.get("username", ""),
                 "avatar": info.get("avatar", "")
             })
-        try:
-            await websocket.send_json({
-                "type": "presence_bulk",
-                "users": online_users
-            })
-        except:
-            pass
+        connection.send({
+            "type": "presence_bulk",
+            "users": online_users
+        })
+
+    # ============ Broadcasts ============
 
     async def broadcast_to_channel(self, channel_id: str, message: dict):
-        """Broadcast message to all connected users (simplified for local dev)"""
-        for user_id, connections in self.active_connections.items():
-            for ws in connections:
-                try:
-                    await ws.send_json(message)
-                except Exception as e:
-                    print(f"DEBUG: Failed to send to {user_id}: {e}")
+        """Broadcast message to the sockets subscribed to a channel"""
+        await self._publish("channel", channel_id=channel_id, frame=encode_frame(message), message_type=message.get("type"))
+
+    def _deliver_to_channel(self, channel_id: str, frame: str, message_type: str):
+        for connection in self.channel_subscribers.get(channel_id, ()):
+            connection.send_frame(frame, message_type)
 
     async def send_personal_message(self, message: dict, user_id: str):
         """Send message directly to a specific user's WebSocket connections"""
-        if user_id in self.active_connections:
-            for ws in self.active_connections[user_id]:
-                try:
-                    await ws.send_json(message)
-                except Exception as e:
-                    print(f"DEBUG: Failed to send to {user_id}: {e}")
+        await self._publish("user", user_id=user_id, frame=encode_frame(message), message_type=message.get("type"))
+
+    def _deliver_to_user(self, user_id: str, frame: str, message_type: str):
+        for connection in self.active_connections.get(user_id, ()):
+            connection.send_frame(frame, message_type)
 
     async def handle_voice_join(self, channel_id: str, user: dict):
-        async with self._lock:
-            if channel_id not in self.voice_occupants:
-                self.voice_occupants[channel_id] = []
-            self.voice_occupants[channel_id] = [u for u in self.voice_occupants[channel_id] if u['id'] != user['id']]
-            self.voice_occupants[channel_id].append(user)
-            print(f"DEBUG: User {user['username']} joined voice {channel_id}")
-            await self.broadcast_voice_state(channel_id)
+        await self._publish("voice_join", channel_id=channel_id, user=user)
 
     async def handle_voice_leave(self, channel_id: str, user_id: str):
-        async with self._lock:
-            if channel_id in self.voice_occupants:
-                self.voice_occupants[channel_id] = [u for u in self.voice_occupants[channel_id] if u['id'] != user_id]
-                print(f"DEBUG: User {user_id} left voice {channel_id}")
-                await self.broadcast_voice_state(channel_id)
+        await self._publish("voice_leave", channel_id=channel_id, user_id=user_id)
 
-    async def broadcast_voice_state(self, channel_id: str):
+    def _on_voice_join(self, channel_id: str, user: dict):
+        # No await between the update and the enqueue, so no lock is needed
+        occupants = [u for u in self.voice_occupants.get(channel_id, []) if u['id'] != user['id']]
+        occupants.append(user)
+        self.voice_occupants[channel_id] = occupants
+        print(f"DEBUG: User {user['username']} joined voice {channel_id}")
+        self.broadcast_voice_state(channel_id)
+
+    def _on_voice_leave(self, channel_id: str, user_id: str):
+        if channel_id in self.voice_occupants:
+            self.voice_occupants[channel_id] = [u for u in self.voice_occupants[channel_id] if u['id'] != user_id]
+            print(f"DEBUG: User {user_id} left voice {channel_id}")
+            self.broadcast_voice_state(channel_id)
+
+    def broadcast_voice_state(self, channel_id: str):
+        """Send the voice occupants of a channel to local subscribers (every worker holds the same state)"""
         users = self.voice_occupants.get(channel_id, [])
         message = {
             "type": "voice_state_update",
             "channel_id": channel_id,
             "users": users
         }
-        for user_id, connections in self.active_connections.items():
-            for ws in connections:
-                try:
-                    await ws.send_json(message)
-                except:
-                    pass
+        self._deliver_to_channel(channel_id, encode_frame(message), "voice_state_update")
+
+    # ============ Caches ============
+
+    async def invalidate_user(self, user_id: str):
+        """Drop a changed (or deactivated) user from the auth cache of every worker."""
+        await self._publish("invalidate_user", user_id=user_id)
+
+    async def invalidate_permissions(self, server_id: str, user_id: str = None):
+        """Drop cached permissions of a member (or of a whole server) on every worker."""
+        await self._publish("invalidate_permissions", server_id=server_id, user_id=user_id)
+
+    async def set_sanction(
+        self, kind: str, server_id: str, user_id: str, active: bool, expires_at: Optional[datetime] = None
+    ):
+        """
+        Add (or lift) a ban/timeout in the sanctions index of every worker. Lifting
+        with `expires_at` is an expiry; without it (a moderator lifted it) each
+        worker re-reads the infractions that remain active for that user.
+        """
+        await self._publish(
+            "sanction", kind=kind, server_id=server_id, user_id=user_id, active=active,
+            expires_at=expires_at.isoformat() if expires_at else None
+        )
+
+    async def update_member_roles(self, server_id: str, user_id: str, role_ids: List[str]):
+        """Apply a member's new roles to permissions and channel visibility on every worker."""
+        await self._publish("member_roles", server_id=server_id, user_id=user_id, role_ids=list(role_ids))
+
+    async def update_role(self, server_id: str, role_id: str, permissions: Optional[int]):
+        """Apply a created/changed role (permissions=None when deleted) on every worker."""
+        await self._publish("role", server_id=server_id, role_id=role_id, permissions=permissions)
+
+    async def update_channel_overwrites(self, server_id: str, channel_id: str, overwrites: List[list]):
+        """Apply a channel's permission overwrites ([target_type, target_id, allow, deny]) on every worker."""
+        await self._publish("overwrites", server_id=server_id, channel_id=channel_id, overwrites=overwrites)
+
+    def _refresh_visibility(self, server_id: str, user_ids: Iterable[str]):
+        state = channel_engine.loaded(server_id)
+        if state is None:
+            return
+        for user_id in user_ids:
+            if self._is_connected_here(user_id):
+                self._set_visible_channels(user_id, server_id, state.visible_channels(user_id))
+
+    def _on_member_roles(self, server_id: str, user_id: str, role_ids: List[str]):
+        invalidate_permissions(server_id, user_id)
+        state = channel_engine.loaded(server_id)
+        if state is not None:
+            state.set_member(user_id, role_ids)
+            self._refresh_visibility(server_id, [user_id])
+
+    def _on_role(self, server_id: str, role_id: str, permissions: Optional[int]):
+        invalidate_permissions(server_id)
+        state = channel_engine.loaded(server_id)
+        if state is not None:
+            self._refresh_visibility(server_id, state.set_role(role_id, permissions))
+
+    def _on_overwrites(self, server_id: str, channel_id: str, overwrites: List[list]):
+        state = channel_engine.loaded(server_id)
+        if state is None:
+            return
+        state.set_overwrites(channel_id, {
+            (target_type, target_id): (allow, deny) for target_type, target_id, allow, deny in overwrites
+        })
+        self._refresh_visibility(server_id, list(self.server_users.get(server_id, ())))
+
+    # ============ Backplane Events ============
+
+    async def _handle_event(self, event: dict):
+        """Apply an event received from the backplane to this worker's sockets."""
+        op = event.get("op")
+        if op == "channel":
+            self._deliver_to_channel(event["channel_id"], event["frame"], event.get("message_type"))
+        elif op == "user":
+            self._deliver_to_user(event["user_id"], event["frame"], event.get("message_type"))
+        elif op == "presence":
+            await self._on_presence(event)
+        elif op == "voice_join":
+            self._on_voice_join(event["channel_id"], event["user"])
+        elif op == "voice_leave":
+            self._on_voice_leave(event["channel_id"], event["user_id"])
+        elif op == "join_server":
+            await self._on_join_server(event["user_id"], event["server_id"], event["channel_ids"])
+        elif op == "leave_server":
+            self._on_leave_server(event["user_id"], event["server_id"])
+        elif op == "add_channel":
+            await self._on_add_channel(event["server_id"], event["channel_id"])
+        elif op == "remove_server":
+            self._on_remove_server(event["server_id"])
+        elif op == "friendship":
+            self._on_friendship(event["user_id"], event["friend_id"], event["added"])
+        elif op == "invalidate_user":
+            user_cache.delete(event["user_id"])
+        elif op == "invalidate_permissions":
+            invalidate_permissions(event["server_id"], event.get("user_id"))
+        elif op == "sanction":
+            expires_at = datetime.fromisoformat(event["expires_at"]) if event.get("expires_at") else None
+            if event["active"]:
+                sanctions.add(event["kind"], event["server_id"], event["user_id"], expires_at)
+            elif expires_at is not None:
+                sanctions.remove(event["kind"], event["server_id"], event["user_id"], expires_at)
+            else:
+                # Lifted by a moderator: other infractions of the same kind may still be active
+                await sanctions.refresh(event["kind"], event["server_id"], event["user_id"])
+        elif op == "member_roles":
+            self._on_member_roles(event["server_id"], event["user_id"], event["role_ids"])
+        elif op == "role":
+            self._on_role(event["server_id"], event["role_id"], event.get("permissions"))
+        elif op == "overwrites":
+            self._on_overwrites(event["server_id"], event["channel_id"], event["overwrites"])
+        else:
+            print(f"DEBUG: Unknown backplane event {op}")
 
 manager = ConnectionManager()
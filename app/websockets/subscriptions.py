@@ -0,0 +1,46 @@
+"""
+Database lookups that seed the ConnectionManager subscription index.
+"""
+import uuid
+from typing import Dict, List
+
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.server import Server, Channel, ServerMember
+from app.models.friendship import Friendship, FriendshipStatus
+from app.core.channel_permissions import channel_engine
+
+
+async def get_user_subscriptions(db: AsyncSession, user_id: uuid.UUID) -> Dict[str, List[str]]:
+    """Map every server the user belongs to (or owns) onto the channel IDs they can see."""
+    result = await db.execute(
+        select(Server.id)
+        .outerjoin(ServerMember, ServerMember.server_id == Server.id)
+        .where(
+            (ServerMember.user_id == user_id) |
+            (Server.owner_id == user_id)
+        )
+        .distinct()
+    )
+    servers: Dict[str, List[str]] = {}
+    for server_id in result.scalars().all():
+        servers[str(server_id)] = await channel_engine.visible_channels(str(server_id), str(user_id), db)
+    return servers
+
+
+async def get_server_channel_ids(db: AsyncSession, server_id: uuid.UUID) -> List[str]:
+    """List the channel IDs of a server."""
+    result = await db.execute(select(Channel.id).where(Channel.server_id == server_id))
+    return [str(c) for c in result.scalars().all()]
+
+
+async def get_friend_ids(db: AsyncSession, user_id: uuid.UUID) -> List[str]:
+    """List the IDs of the user's accepted friends (requests in either direction)."""
+    result = await db.execute(
+        select(Friendship.user_id, Friendship.friend_id).where(
+            or_(Friendship.user_id == user_id, Friendship.friend_id == user_id),
+            Friendship.status == FriendshipStatus.ACCEPTED
+        )
+    )
+    return [str(b if a == user_id else a) for a, b in result.all()]
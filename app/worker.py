@@ -0,0 +1,67 @@
+"""
+arq worker for scheduled background jobs.
+
+    arq app.worker.WorkerSettings
+
+Used when JOB_BACKEND=arq. Set GATEWAY_BACKPLANE=redis as well so the
+notifications sent from here reach the sockets held by the API workers.
+"""
+import uuid
+from typing import List, Optional
+
+from arq import cron
+from arq.connections import RedisSettings
+
+from app.core.config import settings
+from app.core import message_purge, previews, storage, upload_sessions
+from app.core.infraction_expiry import expire_infractions
+from app.websockets.manager import manager
+
+
+async def expire_infraction(ctx, infraction_ids: List[uuid.UUID]):
+    await expire_infractions(infraction_ids)
+
+
+async def purge_user_messages(
+    ctx, server_id: uuid.UUID, user_id: uuid.UUID, days: int,
+    actor_id: Optional[uuid.UUID] = None, reason: Optional[str] = None
+):
+    await message_purge.purge_user_messages(server_id, user_id, days, actor_id, reason)
+
+
+async def generate_preview(ctx, sha256: str, user_id: Optional[str] = None):
+    await previews.generate_preview(sha256, user_id)
+
+
+async def sweep_expired_infractions(ctx):
+    """Safety net for jobs lost before they ran (e.g. Redis was flushed)."""
+    await expire_infractions()
+
+
+async def collect_garbage(ctx):
+    await storage.collect_garbage()
+
+
+async def sweep_upload_sessions(ctx):
+    await upload_sessions.sweep_sessions()
+
+
+async def startup(ctx):
+    await manager.start()
+
+
+async def shutdown(ctx):
+    await manager.stop()
+    previews.shutdown()
+
+
+class WorkerSettings:
+    functions = [expire_infraction, purge_user_messages, generate_preview]
+    cron_jobs = [
+        cron(sweep_expired_infractions, second=0),  # every minute
+        cron(collect_garbage, minute=0, second=0),  # hourly
+        cron(sweep_upload_sessions, minute=set(range(0, 60, 10)), second=30)  # every 10 minutes
+    ]
+    on_startup = startup
+    on_shutdown = shutdown
+    redis_settings = RedisSettings.from_dsn(settings.REDIS_URL)